@@ -1,8 +1,12 @@
-from sqlalchemy import create_engine, text, TextClause
-from sqlalchemy.engine import Connection, Engine
-from typing import Optional, Union
+from sqlalchemy import create_engine, event, text, TextClause
+from sqlalchemy.engine import URL, Connection, Engine
+from typing import Iterator, List, Optional, Tuple, Union
 from dotenv import load_dotenv
+from modules.hsparkapi import codec, metrics
+from psycopg.types.json import set_json_dumps, set_json_loads
 from os import getenv
+from POC import snapshots
+from POC.latest_cache import LatestStateCache
 import pandas as pd
 
 class DB:
@@ -14,7 +18,15 @@ class DB:
     db_name = getenv("DB_NAME")
     engine: Engine
     conn: Connection = None
-    conn_string = f"postgresql+psycopg://{username}:{password}@{host}:{port}/{db_name}"
+    # Built with URL.create so unset settings don't fail until a connection is actually made (e.g. offline benchmarks)
+    conn_string = URL.create("postgresql+psycopg", username=username, password=password, host=host, port=int(port) if port else None, database=db_name)
+    # Snapshot storage options, see insert_response_record
+    store_deltas: bool = getenv("DB_STORE_DELTAS", "").lower() in ("1", "true", "yes")
+    max_delta_chain: int = 20
+    # Set once ensure_schema has run in this process
+    schema_ready: bool = False
+    # Optional in-process read-through cache for get_latest_response, shared by every DB instance in the process
+    latest_cache: Optional[LatestStateCache] = LatestStateCache(float(getenv("DB_LATEST_CACHE_TTL"))) if getenv("DB_LATEST_CACHE_TTL") else None
 
     def __init__(self):
         """
@@ -22,6 +34,15 @@ class DB:
         Connection details are hardcoded since this class only exists for 1 project
         """
         self.engine = create_engine(self.conn_string)
+        event.listen(self.engine, "connect", self._use_json_codec)
+
+    @staticmethod
+    def _use_json_codec(dbapi_connection, connection_record) -> None:
+        """
+        Makes psycopg decode json/jsonb columns (and encode Json parameters) with the shared codec on every new connection
+        """
+        set_json_loads(codec.loads, dbapi_connection)
+        set_json_dumps(codec.dumps, dbapi_connection)
 
     def __del__(self):
         """
@@ -37,7 +58,8 @@ class DB:
         Connects to the database if the connection is not already open
         """
         if not self.conn or not self.conn._still_open_and_dbapi_connection_is_valid:
-            self.conn = self.engine.connect()
+            with metrics.timer("spark_db_pool_checkout_seconds"):
+                self.conn = self.engine.connect()
 
     def disconnect(self) -> None:
         """
@@ -60,17 +82,21 @@ class DB:
             self.conn.commit()
         return result
     
-    def df_query(self, sql: str, params: Optional[dict] = None) -> pd.DataFrame:
+    def df_query(self, sql: str, params: Optional[dict] = None, conn: Optional[Connection] = None) -> pd.DataFrame:
         """
         Executes a query using pandas and returns the results as a pandas dataframe
         :param sql: SQL query to be executed. Params are represented by %(param_name)s
         :param params: Parameters to be passed to the query
+        :param conn: Connection to use instead of self.conn (e.g. a pooled connection owned by a background thread)
         :return: Pandas dataframe of query results
         """
-        self.connect()
-        df = pd.read_sql_query(sql, self.conn, params=params)
+        if conn is None:
+            self.connect()
+            conn = self.conn
+        df = pd.read_sql_query(sql, conn, params=params)
         return df
 
+    @metrics.timed("spark_db_query_seconds", method="insert_update_auth_data")
     def insert_update_auth_data(self, user_hash: int, pass_hash: int, user_token: str, user_token_expire_dt_tm: str) -> None:
         """
         Inserts or updates (if user_hash already present) the pass/token/expiry in the auth_data table
@@ -86,14 +112,11 @@ class DB:
         DO UPDATE SET
             pass_hash = excluded.pass_hash, user_token = excluded.user_token, user_token_expire_dt_tm = excluded.user_token_expire_dt_tm;
         """)
-        print(user_hash)
-        print(pass_hash)
-        print(user_token)
-        print(user_token_expire_dt_tm)
         self.conn.execute(sql)
         self.conn.commit()
 
 
+    @metrics.timed("spark_db_query_seconds", method="username_exists")
     def username_exists(self, hashed_username: int) -> bool:
         """
         Checks if the username exists in the database
@@ -104,6 +127,7 @@ class DB:
         result = self.execute(sql)
         return result.fetchone()[0]
 
+    @metrics.timed("spark_db_query_seconds", method="password_matches")
     def password_matches(self, hashed_username: int, hashed_password: int) -> bool:
         """
         Checks if the password matches the username in the database
@@ -115,6 +139,7 @@ class DB:
         result = self.execute(sql)
         return result.fetchone()[0]
 
+    @metrics.timed("spark_db_query_seconds", method="get_user_token_details")
     def get_user_token_details(self, hashed_username: int) -> dict:
         """
         Gets the user token and expiration date from the database
@@ -125,52 +150,356 @@ class DB:
         result = self.df_query(sql)
         return result.to_dict(orient="records")[0]
     
+    def ensure_schema(self) -> None:
+        """
+        Runs the schema migrations insert_response_record depends on, once per process
+        Run by python -m POC.db before the front end is started, the migrations themselves are safe to run more than once
+        """
+        if DB.schema_ready:
+            return
+        self.migrate_response_snapshots()
+        self.migrate_latest_state()
+        DB.schema_ready = True
+
+    def migrate_response_snapshots(self) -> None:
+        """
+        Adds the columns used for deduplicated/delta snapshot storage to the response_data table
+        Safe to run more than once, existing rows are treated as full snapshots
+        response_id orders rows that share a retrieve_dt_tm, delta chains are read in (retrieve_dt_tm, response_id) order
+        """
+        self.execute(r"""ALTER TABLE spark.public.response_data
+            ADD COLUMN IF NOT EXISTS content_hash TEXT,
+            ADD COLUMN IF NOT EXISTS last_seen_dt_tm TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS is_delta BOOLEAN NOT NULL DEFAULT FALSE,
+            ADD COLUMN IF NOT EXISTS response_id BIGSERIAL""", commit=True)
+        self.execute(r"""CREATE INDEX IF NOT EXISTS response_data_chain_idx
+            ON spark.public.response_data (user_hash, endpoint, (COALESCE(vehicle_id, 'None')), retrieve_dt_tm DESC, response_id DESC)""", commit=True)
+        self.execute(r"""DROP INDEX IF EXISTS spark.public.response_data_latest_idx""", commit=True)
+
+    def migrate_latest_state(self) -> None:
+        """
+        Creates the response_latest table (newest response per user/endpoint/vehicle) and backfills it from response_data
+        Run after migrate_response_snapshots (ensure_schema runs both). Safe to run more than once, existing latest rows
+        are kept
+        Keys whose newest record is a delta are rebuilt from their chain, keys whose chain has no full snapshot are left
+        out so their reads fall back to the history query
+        """
+        self.execute(r"""CREATE TABLE IF NOT EXISTS spark.public.response_latest (
+            user_hash BIGINT NOT NULL,
+            endpoint TEXT NOT NULL,
+            vehicle_id TEXT NOT NULL,
+            retrieve_dt_tm TIMESTAMPTZ NOT NULL,
+            last_seen_dt_tm TIMESTAMPTZ NOT NULL,
+            content_hash TEXT,
+            response_data JSONB NOT NULL,
+            PRIMARY KEY (user_hash, endpoint, vehicle_id))""", commit=True)
+        # Newest row per key, copied directly when it is a full snapshot
+        self.execute(r"""INSERT INTO spark.public.response_latest (user_hash, endpoint, vehicle_id, retrieve_dt_tm, last_seen_dt_tm, content_hash, response_data)
+        SELECT user_hash, endpoint, vehicle_id, retrieve_dt_tm, last_seen_dt_tm, content_hash, response_data
+        FROM (
+            SELECT DISTINCT ON (user_hash, endpoint, COALESCE(vehicle_id, 'None'))
+                user_hash, endpoint, COALESCE(vehicle_id, 'None') AS vehicle_id, retrieve_dt_tm,
+                COALESCE(last_seen_dt_tm, retrieve_dt_tm) AS last_seen_dt_tm, content_hash, response_data, is_delta
+            FROM spark.public.response_data
+            ORDER BY user_hash, endpoint, COALESCE(vehicle_id, 'None'), retrieve_dt_tm DESC, response_id DESC) AS newest
+        WHERE NOT is_delta
+        ON CONFLICT (user_hash, endpoint, vehicle_id) DO NOTHING""", commit=True)
+        # Keys still missing have a delta as their newest row (or were never stored), rebuild those from their chain
+        missing = self.execute(r"""SELECT DISTINCT data.user_hash, data.endpoint, COALESCE(data.vehicle_id, 'None') AS vehicle_id
+        FROM spark.public.response_data AS data
+        LEFT JOIN spark.public.response_latest AS latest
+            ON latest.user_hash = data.user_hash AND latest.endpoint = data.endpoint AND latest.vehicle_id = COALESCE(data.vehicle_id, 'None')
+        WHERE latest.user_hash IS NULL""").fetchall()
+        chain_sql = r"""SELECT retrieve_dt_tm, COALESCE(last_seen_dt_tm, retrieve_dt_tm) AS last_seen_dt_tm, content_hash, response_data, is_delta
+        FROM spark.public.response_data
+        WHERE user_hash = :user_hash AND endpoint = :endpoint AND COALESCE(vehicle_id, 'None') = :vehicle_id
+            AND retrieve_dt_tm >= (SELECT MAX(retrieve_dt_tm) FROM spark.public.response_data
+                WHERE user_hash = :user_hash AND endpoint = :endpoint AND COALESCE(vehicle_id, 'None') = :vehicle_id AND NOT is_delta)
+        ORDER BY retrieve_dt_tm, response_id"""
+        for key in missing:
+            key_params = {"user_hash": key.user_hash, "endpoint": key.endpoint, "vehicle_id": key.vehicle_id}
+            chain = self.execute(chain_sql, parameters=key_params).fetchall()
+            if not chain:
+                continue
+            response = snapshots.rebuild([row.response_data for row in chain], [row.is_delta for row in chain])[-1]
+            newest = chain[-1]
+            params = {**key_params, "retrieve_dt_tm": newest.retrieve_dt_tm, "last_seen_dt_tm": newest.last_seen_dt_tm, "content_hash": newest.content_hash, "response_data": snapshots.canonical_json(response).decode()}
+            self.execute(r"""INSERT INTO spark.public.response_latest (user_hash, endpoint, vehicle_id, retrieve_dt_tm, last_seen_dt_tm, content_hash, response_data)
+            VALUES (:user_hash, :endpoint, :vehicle_id, :retrieve_dt_tm, :last_seen_dt_tm, :content_hash, :response_data)
+            ON CONFLICT (user_hash, endpoint, vehicle_id) DO NOTHING""", commit=True, parameters=params)
+
+    # Keeps response_latest in step with insert_response_record. vehicle_id is 'None' for non-vehicle endpoints so it can
+    # be part of the primary key. An unchanged response keeps its original retrieve_dt_tm, matching the history table,
+    # and late (out of order) writes never replace a newer row
+    _upsert_latest_sql = r"""INSERT INTO spark.public.response_latest (user_hash, endpoint, vehicle_id, retrieve_dt_tm, last_seen_dt_tm, content_hash, response_data)
+        VALUES (:user_hash, :endpoint, :vehicle_id, :retrieve_dt_tm, :retrieve_dt_tm, :content_hash, :response_data)
+        ON CONFLICT (user_hash, endpoint, vehicle_id) DO UPDATE SET
+            retrieve_dt_tm = CASE WHEN response_latest.content_hash = excluded.content_hash THEN response_latest.retrieve_dt_tm ELSE excluded.retrieve_dt_tm END,
+            last_seen_dt_tm = excluded.last_seen_dt_tm,
+            content_hash = excluded.content_hash,
+            response_data = excluded.response_data
+        WHERE response_latest.last_seen_dt_tm <= excluded.last_seen_dt_tm"""
+
     # TODO: Add type for retrieve_dt, maybe Union datetime/str with the pd type
-    # Should response be dict or str?
-    def insert_response_record(self, user_hash: int, retrieve_dt_tm: str, endpoint: str, response_data: str, vehicle_id: Optional[str] = None) -> None:
+    @metrics.timed("spark_db_query_seconds", method="insert_response_record")
+    def insert_response_record(self, user_hash: int, retrieve_dt_tm: str, endpoint: str, response_data: Union[dict, list, str, bytes], vehicle_id: Optional[str] = None) -> None:
         """
         Inserts a record into the response_data table
+        If the response is identical to the latest stored one, only that record's last_seen_dt_tm is updated
         :param user_hash: Hashed username
         :param retrieve_dt_tm: Datetime of retrieval
         :param endpoint: Endpoint that was retrieved
-        :param response_data: Response data from endpoint
+        :param response_data: Response data from endpoint, decoded (preferred, it is only encoded once) or as JSON text
         :param vehicle_id: Vehicle ID (if applicable)
+
+        Note:
+        Uses its own pooled connection rather than self.conn so it can safely be called from a background thread
+        When store_deltas is set, changed responses are stored as a delta from the previous snapshot (see POC.snapshots)
+        with a full snapshot written at least every max_delta_chain records
+        Each delta is relative to the row before it in (retrieve_dt_tm, response_id) order. A late write (retrieve_dt_tm
+        not after the newest stored record) is stored in full, and the delta that follows it is rewritten in full so its
+        base is not changed underneath it
+        The response_latest row for the key is upserted in the same transaction (see get_latest_response)
+        """
+        key_params = {"user_hash": user_hash, "endpoint": endpoint, "vehicle_id": vehicle_id if vehicle_id else "None"}
+        response = codec.loads(response_data) if isinstance(response_data, (str, bytes)) else response_data
+        # The canonical form is stored as well as hashed, jsonb discards key order and whitespace anyway
+        canonical = snapshots.canonical_json(response)
+        response_hash = snapshots.canonical_hash(canonical)
+        response_data = canonical.decode()
+        # Serialise writers per key (a row lock can't cover a key's first insert, or a newer row added while waiting)
+        lock_sql = r"""SELECT pg_advisory_xact_lock(hashtextextended(CONCAT_WS('/', CAST(:user_hash AS TEXT), CAST(:endpoint AS TEXT), CAST(:vehicle_id AS TEXT)), 0))"""
+        latest_sql = r"""SELECT response_id, content_hash, retrieve_dt_tm >= CAST(:retrieve_dt_tm AS TIMESTAMPTZ) AS is_newer
+        FROM spark.public.response_data
+        WHERE user_hash = :user_hash AND endpoint = :endpoint AND COALESCE(vehicle_id, 'None') = :vehicle_id
+        ORDER BY retrieve_dt_tm DESC, response_id DESC
+        LIMIT 1"""
+        seen_sql = r"""UPDATE spark.public.response_data
+        SET last_seen_dt_tm = GREATEST(COALESCE(last_seen_dt_tm, retrieve_dt_tm), CAST(:retrieve_dt_tm AS TIMESTAMPTZ))
+        WHERE response_id = :response_id"""
+        insert_sql = r"""INSERT INTO spark.public.response_data (user_hash, retrieve_dt_tm, endpoint, response_data, vehicle_id, content_hash, last_seen_dt_tm, is_delta)
+        VALUES(:user_hash, :retrieve_dt_tm, :endpoint, :response_data, NULLIF(:vehicle_id, 'None'), :content_hash, :retrieve_dt_tm, :is_delta)"""
+        with metrics.timer("spark_db_pool_checkout_seconds"):
+            conn = self.engine.connect()
+        with conn, conn.begin():
+            conn.execute(text(lock_sql), parameters=key_params)
+            latest = conn.execute(text(latest_sql), parameters={**key_params, "retrieve_dt_tm": retrieve_dt_tm}).fetchone()
+            if latest is not None and latest.content_hash == response_hash:
+                conn.execute(text(seen_sql), parameters={"response_id": latest.response_id, "retrieve_dt_tm": retrieve_dt_tm})
+            elif latest is not None and latest.is_newer:
+                self._insert_late_record(conn, key_params, retrieve_dt_tm, response_data, response_hash)
+            else:
+                stored, is_delta = response_data, False
+                if self.store_deltas and latest is not None:
+                    previous = self._latest_snapshot(conn, key_params)
+                    if previous is not None:
+                        delta = snapshots.canonical_json(snapshots.diff(previous, response)).decode()
+                        # Deltas of list-heavy payloads (e.g. trips) can end up larger than the response itself
+                        if len(delta) < len(response_data):
+                            stored, is_delta = delta, True
+                params = {**key_params, "retrieve_dt_tm": retrieve_dt_tm, "response_data": stored, "content_hash": response_hash, "is_delta": is_delta}
+                conn.execute(text(insert_sql), parameters=params)
+            conn.execute(text(self._upsert_latest_sql), parameters={**key_params, "retrieve_dt_tm": retrieve_dt_tm, "response_data": response_data, "content_hash": response_hash})
+        if self.latest_cache is not None:
+            self.latest_cache.invalidate(user_hash, endpoint, key_params["vehicle_id"])
+
+    def _insert_late_record(self, conn: Connection, key_params: dict, retrieve_dt_tm: str, response_data: str, response_hash: str) -> None:
+        """
+        Inserts a response retrieved before the newest stored record as a full snapshot
+        The next record after it is rewritten as a full snapshot if it is a delta, since its base would otherwise become
+        the late record
+        :param conn: Connection to write with (the caller's transaction, holding the key's lock)
+        :param key_params: user_hash, endpoint and vehicle_id ('None' if not applicable)
+        :param retrieve_dt_tm: Datetime of retrieval
+        :param response_data: Canonical JSON of the response
+        :param response_hash: Content hash of the response
+        """
+        # Rows sharing retrieve_dt_tm with the late record sort before it (it gets the highest response_id)
+        next_sql = r"""SELECT response_id, is_delta
+        FROM spark.public.response_data
+        WHERE user_hash = :user_hash AND endpoint = :endpoint AND COALESCE(vehicle_id, 'None') = :vehicle_id
+            AND retrieve_dt_tm > CAST(:retrieve_dt_tm AS TIMESTAMPTZ)
+        ORDER BY retrieve_dt_tm, response_id
+        LIMIT 1"""
+        next_row = conn.execute(text(next_sql), parameters={**key_params, "retrieve_dt_tm": retrieve_dt_tm}).fetchone()
+        if next_row is not None and next_row.is_delta:
+            following = self._latest_snapshot(conn, key_params, through_id=next_row.response_id)
+            if following is not None:
+                conn.execute(text(r"""UPDATE spark.public.response_data SET response_data = :response_data, is_delta = FALSE
+                WHERE response_id = :response_id"""), parameters={"response_id": next_row.response_id, "response_data": snapshots.canonical_json(following).decode()})
+        conn.execute(text(r"""INSERT INTO spark.public.response_data (user_hash, retrieve_dt_tm, endpoint, response_data, vehicle_id, content_hash, last_seen_dt_tm, is_delta)
+        VALUES(:user_hash, :retrieve_dt_tm, :endpoint, :response_data, NULLIF(:vehicle_id, 'None'), :content_hash, :retrieve_dt_tm, FALSE)"""),
+            parameters={**key_params, "retrieve_dt_tm": retrieve_dt_tm, "response_data": response_data, "content_hash": response_hash})
+
+    def _latest_snapshot(self, conn: Connection, key_params: dict, through_id: Optional[int] = None):
+        """
+        Rebuilds the newest stored snapshot for a key from its delta chain
+        :param conn: Connection to read with (the caller's transaction)
+        :param key_params: user_hash, endpoint and vehicle_id ('None' if not applicable)
+        :param through_id: Rebuild the snapshot of this response_id rather than the newest one (if provided), reading back
+            as far as the last full snapshot
+        :return: Full response, or None if the chain is already max_delta_chain long and a full snapshot is due
         """
-        sql = r"""INSERT INTO spark.public.response_data (user_hash, retrieve_dt_tm, endpoint, response_data, vehicle_id)
-        VALUES(:user_hash, :retrieve_dt_tm, :endpoint, :response_data, NULLIF(:vehicle_id, 'None'))"""
-        params = {"user_hash": user_hash, "retrieve_dt_tm": retrieve_dt_tm, "endpoint": endpoint, "response_data": response_data, "vehicle_id": vehicle_id}
-        self.execute(sql, commit=True, parameters=params)
+        sql = r"""SELECT response_data, is_delta
+        FROM spark.public.response_data
+        WHERE user_hash = :user_hash AND endpoint = :endpoint AND COALESCE(vehicle_id, 'None') = :vehicle_id
+            AND (CAST(:through_id AS BIGINT) IS NULL OR (retrieve_dt_tm, response_id) <= (
+                SELECT retrieve_dt_tm, response_id FROM spark.public.response_data WHERE response_id = CAST(:through_id AS BIGINT)))
+        ORDER BY retrieve_dt_tm DESC, response_id DESC
+        LIMIT :chain_limit"""
+        chain_limit = self.max_delta_chain if through_id is None else None
+        rows = conn.execute(text(sql), parameters={**key_params, "through_id": through_id, "chain_limit": chain_limit}).fetchall()
+        for depth, row in enumerate(rows):
+            if not row.is_delta:
+                chain = rows[:depth + 1][::-1]
+                return snapshots.rebuild([row.response_data for row in chain], [row.is_delta for row in chain])[-1]
+        return None
 
+    @metrics.timed("spark_db_query_seconds", method="get_latest_response")
+    def get_latest_response(self, user_hash: int, endpoint: str, vehicle_id: Optional[str] = None) -> Optional[Tuple[dict, pd.Timestamp]]:
+        """
+        Get the newest response for a given endpoint/user/vehicle from response_latest (a primary key lookup)
+        Served from latest_cache when it is enabled
+        :param user_hash: Hashed username
+        :param endpoint: Endpoint to retrieve data for
+        :param vehicle_id: Vehicle ID to retrieve data for (if applicable)
+        :return: (response_data, retrieve_dt_tm), or None if nothing is stored for the key
+        """
+        vehicle_id = vehicle_id if vehicle_id else "None"
+        if self.latest_cache is not None:
+            cached = self.latest_cache.get(user_hash, endpoint, vehicle_id)
+            if cached is not None:
+                return cached
+            # Taken before the read so a write committed in the meantime stops the stale row being cached
+            version = self.latest_cache.version(user_hash, endpoint, vehicle_id)
+        sql = r"""SELECT response_data, retrieve_dt_tm
+        FROM spark.public.response_latest
+        WHERE user_hash = :user_hash AND endpoint = :endpoint AND vehicle_id = :vehicle_id"""
+        with metrics.timer("spark_db_pool_checkout_seconds"):
+            conn = self.engine.connect()
+        with conn:
+            row = conn.execute(text(sql), parameters={"user_hash": user_hash, "endpoint": endpoint, "vehicle_id": vehicle_id}).fetchone()
+        if row is None:
+            return None
+        latest = (row.response_data, pd.Timestamp(row.retrieve_dt_tm))
+        if self.latest_cache is not None:
+            self.latest_cache.put(user_hash, endpoint, vehicle_id, latest, version=version)
+        return latest
 
-    def get_endpoint_response(self, user_hash: int, endpoint: str, record_cnt: int, vehicle_id: Optional[str] = None) -> pd.DataFrame:
+    @metrics.timed("spark_db_query_seconds", method="get_endpoint_response")
+    def get_endpoint_response(self, user_hash: int, endpoint: str, record_cnt: int, vehicle_id: Optional[str] = None, before_dt_tm: Optional[str] = None) -> pd.DataFrame:
         """
         Get the response data for a given endpoint for a given user (and vehicle for vehicle endpoints)
         :param user_hash: Hashed username
         :param endpoint: Endpoint to retrieve data for
         :param record_cnt: Number of records to retrieve
         :param vehicle_id: Vehicle ID to retrieve data for (if applicable)
+        :param before_dt_tm: Only retrieve records strictly older than this datetime (if provided)
         :return: Pandas DataFrame containing response data
 
         Note:
         Returns a wide DataFrame with the response_data expanded into columns and the retrieve_dt_tm as a column
+        Records stored as deltas are rebuilt into full responses before being returned
+        Unchanged responses are only stored once (see insert_response_record), so record_cnt counts distinct snapshots
+        rather than polls
+        Uses its own pooled connection rather than self.conn so it can safely be called from a background thread
         """
+        # psycopg sends a repeated named parameter as a single $n, so before_dt_tm is cast in both places to give it one type
+        # before_id breaks retrieve_dt_tm ties when paging back from a result row, rows at before_dt_tm are skipped without it
         sql = r"""SELECT 
             response_data,
-            retrieve_dt_tm 
+            retrieve_dt_tm,
+            response_id,
+            is_delta
         FROM spark.public.response_data
         WHERE 
             user_hash = %(user_hash)s 
             AND endpoint = %(endpoint)s 
             AND COALESCE(vehicle_id, 'None') = %(vehicle_id)s
-        ORDER BY retrieve_dt_tm DESC
+            AND (CAST(%(before_dt_tm)s AS TIMESTAMPTZ) IS NULL
+                OR (retrieve_dt_tm, response_id) < (CAST(%(before_dt_tm)s AS TIMESTAMPTZ), COALESCE(CAST(%(before_id)s AS BIGINT), 0)))
+        ORDER BY retrieve_dt_tm DESC, response_id DESC
         LIMIT %(record_cnt)s"""
+        if record_cnt == 1 and before_dt_tm is None:
+            # Current data only needs the newest record, which response_latest answers without touching the history
+            latest = self.get_latest_response(user_hash, endpoint, vehicle_id)
+            if latest is not None:
+                return pd.merge(pd.DataFrame([latest[0]]), pd.DataFrame({"retrieve_dt_tm": [latest[1]]}), left_index=True, right_index=True)
         vehicle_id = vehicle_id if vehicle_id else "None"
-        params = {"user_hash": user_hash, "endpoint": endpoint, "record_cnt": record_cnt, "vehicle_id": vehicle_id}
-        result = self.df_query(sql, params=params)
+        params = {"user_hash": user_hash, "endpoint": endpoint, "record_cnt": record_cnt, "vehicle_id": vehicle_id, "before_dt_tm": before_dt_tm, "before_id": None}
+        with metrics.timer("spark_db_pool_checkout_seconds"):
+            conn = self.engine.connect()
+        with conn:
+            result = self.df_query(sql, params=params, conn=conn)
+            if result["is_delta"].any():
+                # Pull the rows older than the oldest result back to the previous full snapshot so the deltas can be applied
+                base_params = {**params, "record_cnt": self.max_delta_chain, "before_dt_tm": result["retrieve_dt_tm"].iloc[-1], "before_id": int(result["response_id"].iloc[-1])}
+                base = self.df_query(sql, params=base_params, conn=conn)
+            else:
+                base = None
+        if base is not None:
+            result["response_data"] = snapshots.rebuild_window(
+                result["response_data"].tolist(), result["is_delta"].tolist(), base["response_data"].tolist(), base["is_delta"].tolist()
+            )
         # Use to_list on response_data to try to expand json into columns
         # Merge the retrieve_dt_tm with the wide response_data
         return pd.merge(pd.DataFrame(result["response_data"].tolist()), pd.DataFrame(result["retrieve_dt_tm"]), left_index=True, right_index=True)
     
+    def stream_response_records(self, user_hash: int, endpoint: str, vehicle_id: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None, chunk_size: int = 5000) -> Iterator[List[dict]]:
+        """
+        Streams the response data for a given endpoint/user/vehicle in time order through a server-side cursor
+        Only chunk_size rows are held in memory at a time, so this is safe to use for exporting long histories
+        :param user_hash: Hashed username
+        :param endpoint: Endpoint to retrieve data for
+        :param vehicle_id: Vehicle ID to retrieve data for (if applicable)
+        :param since: Only retrieve records at or after this datetime (if provided)
+        :param until: Only retrieve records strictly before this datetime (if provided)
+        :param chunk_size: Number of rows fetched from the cursor at a time
+        :return: Iterator of lists of {"retrieve_dt_tm", "last_seen_dt_tm", "response_data"} dicts, oldest first
+
+        Note:
+        Uses its own pooled connection. Records stored as deltas are rebuilt, so the scan starts at the last full
+        snapshot before since and the rows before since are only used as the base for the deltas
+        """
+        sql = r"""SELECT
+            retrieve_dt_tm,
+            last_seen_dt_tm,
+            response_data,
+            is_delta,
+            (CAST(:since AS TIMESTAMPTZ) IS NULL OR retrieve_dt_tm >= CAST(:since AS TIMESTAMPTZ)) AS in_window
+        FROM spark.public.response_data
+        WHERE
+            user_hash = :user_hash
+            AND endpoint = :endpoint
+            AND COALESCE(vehicle_id, 'None') = :vehicle_id
+            AND retrieve_dt_tm >= COALESCE(
+                (SELECT MAX(retrieve_dt_tm) FROM spark.public.response_data
+                WHERE user_hash = :user_hash AND endpoint = :endpoint AND COALESCE(vehicle_id, 'None') = :vehicle_id
+                    AND NOT is_delta AND retrieve_dt_tm <= CAST(:since AS TIMESTAMPTZ)),
+                CAST(:since AS TIMESTAMPTZ),
+                '-infinity')
+            AND (CAST(:until AS TIMESTAMPTZ) IS NULL OR retrieve_dt_tm < CAST(:until AS TIMESTAMPTZ))
+        ORDER BY retrieve_dt_tm, response_id"""
+        params = {"user_hash": user_hash, "endpoint": endpoint, "vehicle_id": vehicle_id if vehicle_id else "None", "since": since, "until": until}
+        with metrics.timer("spark_db_pool_checkout_seconds"):
+            conn = self.engine.connect()
+        with conn:
+            result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(text(sql), parameters=params)
+            previous = None
+            for partition in result.partitions():
+                records = []
+                for row in partition:
+                    if row.is_delta:
+                        # A delta without a base (e.g. the base row was deleted) can't be rebuilt, so it is skipped
+                        previous = snapshots.apply_delta(previous, row.response_data) if previous is not None else None
+                    else:
+                        previous = row.response_data
+                    if row.in_window and previous is not None:
+                        records.append({"retrieve_dt_tm": row.retrieve_dt_tm, "last_seen_dt_tm": row.last_seen_dt_tm, "response_data": previous})
+                if records:
+                    yield records
+
+    @metrics.timed("spark_db_query_seconds", method="get_default_vehicle_id")
     def get_default_vehicle_id(self, user_hash: int) -> str:
         """
         Gets the default vehicle_id for the user from user_preferences table
@@ -185,6 +514,7 @@ class DB:
             result = None
         return result
     
+    @metrics.timed("spark_db_query_seconds", method="insert_update_vehicle_id")
     def insert_update_vehicle_id(self, user_hash: int, vehicle_id: str) -> None:
         """
         Inserts or updates (if user_hash already present) the user_preferences table with the provided values
@@ -200,4 +530,15 @@ class DB:
         """)
         self.conn.execute(sql)
         self.conn.commit()
-        
\ No newline at end of file
+
+
+def main() -> None:
+    """
+    Runs the schema migrations (python -m POC.db), once before starting the front end or anything else that writes responses
+    """
+    DB().ensure_schema()
+    print("Schema is up to date")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Columnar bulk export of stored responses
+
+Streams response_data for a user/endpoint/vehicle over a time window out of the database in bounded chunks and
+writes it to a Parquet or Arrow IPC file, with the JSON flattened into one column per leaf field. Run from the
+repository root:
+
+    python -m POC.export --username "HARMAN Spark User" --endpoint vehicle_summary --vehicle-id 123 --since 2023-01-01 out.parquet
+"""
+# Bring parent directory into scope to import modules dir without having to install the package
+import os
+import sys
+import pathlib
+sys.path.append(str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent))
+
+from typing import Iterator, List, Optional
+import argparse
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from POC.db import DB
+
+FORMATS: List[str] = ["parquet", "arrow"]
+# Holds, per row, a JSON object of any fields that didn't fit the schema taken from the first chunk
+UNMAPPED_COLUMN: str = "_unmapped"
+
+
+def flatten_records(records: List[dict]) -> pd.DataFrame:
+    """
+    Flattens a chunk of stream_response_records output into one column per leaf field
+    Nested objects become dotted column names, lists are kept as JSON strings since their shape varies between rows
+    :param records: List of {"retrieve_dt_tm", "last_seen_dt_tm", "response_data"} dicts
+    :return: Flat DataFrame with retrieve_dt_tm and last_seen_dt_tm first
+    """
+    # Endpoints that return a top level list (e.g. associations) are wrapped so every row is an object
+    responses = [response if isinstance(response, dict) else {"data": response} for response in (record["response_data"] for record in records)]
+    flat = pd.json_normalize(responses, sep=".")
+    for column in flat.columns:
+        if flat[column].map(lambda value: isinstance(value, (list, dict))).any():
+            flat[column] = flat[column].map(lambda value: json.dumps(value) if isinstance(value, (list, dict)) else value)
+    flat.insert(0, "last_seen_dt_tm", pd.to_datetime([record["last_seen_dt_tm"] for record in records], utc=True))
+    flat.insert(0, "retrieve_dt_tm", pd.to_datetime([record["retrieve_dt_tm"] for record in records], utc=True))
+    return flat
+
+
+def _column_array(column: pd.Series, arrow_type: Optional[pa.DataType] = None) -> pa.Array:
+    """
+    Converts a flattened column to Arrow, serializing non-string values to JSON when the target type is string
+    """
+    if arrow_type is not None and (pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type)):
+        column = column.map(lambda value: value if isinstance(value, str) or pd.isna(value) else json.dumps(value, default=str))
+    return pa.array(column, type=arrow_type, from_pandas=True)
+
+
+def _initial_schema(flat: pd.DataFrame) -> pa.Schema:
+    """
+    Infers the file schema from the first chunk
+    Columns that are entirely null (None or NaN, e.g. a key missing from every row), or that mix types within the chunk,
+    are typed as strings
+    """
+    fields = []
+    for name in flat.columns:
+        if flat[name].isna().all():
+            fields.append(pa.field(name, pa.string()))
+            continue
+        try:
+            arrow_type = _column_array(flat[name]).type
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields + [pa.field(UNMAPPED_COLUMN, pa.string())])
+
+
+def _conform(flat: pd.DataFrame, schema: pa.Schema) -> pa.RecordBatch:
+    """
+    Casts a chunk to the file schema
+    Columns the schema doesn't know about, or values that don't cast to the schema's type, are moved into UNMAPPED_COLUMN
+    """
+    unmapped: List[dict] = [{} for _ in range(len(flat))]
+    arrays = []
+    for field in schema:
+        if field.name == UNMAPPED_COLUMN:
+            continue
+        if field.name not in flat.columns:
+            arrays.append(pa.nulls(len(flat), field.type))
+            continue
+        column = flat[field.name]
+        try:
+            arrays.append(_column_array(column, field.type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            for row, value in enumerate(column):
+                if not pd.isna(value):
+                    unmapped[row][field.name] = value
+            arrays.append(pa.nulls(len(flat), field.type))
+    for column in flat.columns.difference(schema.names):
+        for row, value in enumerate(flat[column]):
+            if not pd.isna(value):
+                unmapped[row][column] = value
+    arrays.append(pa.array([json.dumps(extra, default=str) if extra else None for extra in unmapped], type=pa.string()))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def iter_record_batches(db: DB, user_hash: int, endpoint: str, vehicle_id: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None, chunk_size: int = 5000) -> Iterator[pa.RecordBatch]:
+    """
+    Streams stored responses as Arrow record batches that all share the schema of the first batch
+    :param db: DB instance to read from
+    :param user_hash: Hashed username
+    :param endpoint: Endpoint to export
+    :param vehicle_id: Vehicle ID to export (if applicable)
+    :param since: Only export records at or after this datetime (if provided)
+    :param until: Only export records strictly before this datetime (if provided)
+    :param chunk_size: Number of rows per batch
+    :return: Iterator of record batches
+    """
+    schema = None
+    for records in db.stream_response_records(user_hash, endpoint, vehicle_id, since, until, chunk_size):
+        flat = flatten_records(records)
+        if schema is None:
+            schema = _initial_schema(flat)
+        yield _conform(flat, schema)
+
+
+def export_responses(path: str, user_hash: int, endpoint: str, vehicle_id: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None, file_format: str = "parquet", chunk_size: int = 5000, db: Optional[DB] = None) -> int:
+    """
+    Writes stored responses to a Parquet or Arrow IPC file one chunk at a time
+    :param path: Output file path
+    :param user_hash: Hashed username
+    :param endpoint: Endpoint to export
+    :param vehicle_id: Vehicle ID to export (if applicable)
+    :param since: Only export records at or after this datetime (if provided)
+    :param until: Only export records strictly before this datetime (if provided)
+    :param file_format: "parquet" or "arrow"
+    :param chunk_size: Number of rows read and written at a time
+    :param db: DB instance to read from (a new one is created if not provided)
+    :return: Number of rows written, no file is created if there are none
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown export format {file_format}, expected one of {', '.join(FORMATS)}")
+    db = db if db is not None else DB()
+    writer = None
+    rows = 0
+    try:
+        for batch in iter_record_batches(db, user_hash, endpoint, vehicle_id, since, until, chunk_size):
+            if writer is None:
+                writer = pq.ParquetWriter(path, batch.schema) if file_format == "parquet" else pa.ipc.new_file(path, batch.schema)
+            if file_format == "parquet":
+                writer.write_batch(batch)
+            else:
+                writer.write(batch)
+            rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def main(argv: Optional[list] = None) -> None:
+    from POC.poc import POC
+
+    parser = argparse.ArgumentParser(description="Export stored responses to Parquet or Arrow")
+    user = parser.add_mutually_exclusive_group(required=True)
+    user.add_argument("--username", help="HARMAN Spark username (hashed the same way as the POC)")
+    user.add_argument("--user-hash", type=int, help="Already hashed username")
+    parser.add_argument("--endpoint", required=True, help="Endpoint name, e.g. vehicle_summary")
+    parser.add_argument("--vehicle-id", default=None, help="Vehicle ID for vehicle_* endpoints")
+    parser.add_argument("--since", default=None, help="Start of the window (inclusive)")
+    parser.add_argument("--until", default=None, help="End of the window (exclusive)")
+    parser.add_argument("--format", default=None, choices=FORMATS, help="Output format, defaults to the output file's extension")
+    parser.add_argument("--chunk-size", default=5000, type=int, help="Rows read from the database at a time")
+    parser.add_argument("output", help="Output file path")
+    args = parser.parse_args(argv)
+
+    user_hash = args.user_hash if args.user_hash is not None else POC().constant_hash(args.username)
+    file_format = args.format or ("arrow" if pathlib.Path(args.output).suffix in (".arrow", ".feather", ".ipc") else "parquet")
+    rows = export_responses(args.output, user_hash, args.endpoint, args.vehicle_id, args.since, args.until, file_format, args.chunk_size)
+    print(f"Exported {rows} rows to {args.output}" if rows else "No records found, nothing was written")
+
+
+if __name__ == '__main__':
+    main()
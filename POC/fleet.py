@@ -0,0 +1,392 @@
+"""
+Multi-account fleet manager
+
+Holds many Spark accounts, keeps each one's token current through POC.attempt_auth_flow on a background thread, and
+shards the accounts' vehicles across a pool of worker processes for polling and trip processing. Each worker has its own task queue so a
+vehicle is always handled by the same process until the assignment changes, and vehicles from the same account are
+kept together where the balance allows it so one account's slow upstream mostly holds up only its own worker(s).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+import itertools
+import math
+import multiprocessing
+import queue
+import threading
+import pandas as pd
+from modules.hsparkapi import API
+
+# Endpoints polled by default, all take a vehicle ID
+DEFAULT_POLL_ENDPOINTS: List[str] = ["vehicle_summary", "vehicle_health", "vehicle_location"]
+
+# Longest wait between login attempts for an account whose token refresh keeps failing
+MAX_AUTH_BACKOFF: pd.Timedelta = pd.Timedelta(minutes=30)
+
+
+def trip_summary(payload: dict) -> dict:
+    """
+    Default trip handler: reduces a trip week to counts so the multi-MB payload never leaves the worker
+    Speed is in km/h (see API.query_vehicle_trips)
+    :param payload: Raw JSON response from query_vehicle_trips
+    :return: Dict of trip_count, point_count and max_speed
+    """
+    trips = payload.get("trips", []) if isinstance(payload, dict) else []
+    speeds = [point.get("speed") or 0 for trip in trips for point in trip.get("points", [])]
+    return {"trip_count": len(trips), "point_count": len(speeds), "max_speed": max(speeds, default=0)}
+
+
+def _run_job(api_cache: Dict[str, API], base_urls: Tuple[Optional[str], Optional[str]], job: tuple, task: tuple):
+    """
+    Runs one (account, vehicle) job inside a worker
+    :return: (account, vehicle_id, results) where results maps endpoint (or "trips") to data or {"error": message}
+    """
+    account, authorization, vehicle_id = job
+    api = api_cache.get(authorization)
+    if api is None:
+        api = api_cache[authorization] = API(authorization, *base_urls)
+    results = {}
+    if task[0] == "poll":
+        for endpoint in task[1]:
+            try:
+                results[endpoint] = getattr(api, f"query_{endpoint}")(vehicle_id)
+            except Exception as e:
+                results[endpoint] = {"error": str(e)}
+    else:
+        _, since, until, handler = task
+        try:
+            results["trips"] = handler(api.query_vehicle_trips(vehicle_id, since, until))
+        except Exception as e:
+            results["trips"] = {"error": str(e)}
+    return account, vehicle_id, results
+
+
+def _worker_main(worker_index: int, tasks: multiprocessing.Queue, results: multiprocessing.Queue, threads: int, base_urls: Tuple[Optional[str], Optional[str]]) -> None:
+    """
+    Worker process loop: takes (request_id, jobs, task) batches until it receives None
+    Jobs within a batch run on a small thread pool since polling is mostly waiting on the upstream
+    """
+    # API objects are reused per token so connections/headers aren't rebuilt for every request
+    api_cache: Dict[str, API] = {}
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        while True:
+            message = tasks.get()
+            if message is None:
+                return
+            request_id, jobs, task = message
+            try:
+                batch = list(pool.map(lambda job: _run_job(api_cache, base_urls, job, task), jobs))
+            except Exception as e:
+                batch = [(account, vehicle_id, {"error": str(e)}) for account, _, vehicle_id in jobs]
+            results.put((request_id, worker_index, batch))
+
+
+class Account:
+    """
+    Credentials and current token for one Spark account
+    """
+    username: str
+    password: str
+    access_token: Optional[str] = None
+    expires_at: Optional[pd.Timestamp] = None
+    # Message of the last failed token refresh, cleared by the next successful one
+    auth_error: Optional[str] = None
+    # Message of the last failed refresh_vehicles, cleared by the next successful one
+    vehicles_error: Optional[str] = None
+    vehicle_ids: List[str]
+
+    def __init__(self, username: str, password: str, vehicle_ids: Optional[List[str]] = None):
+        """
+        :param username: Spark username, also used as the account key
+        :param password: Spark password
+        :param vehicle_ids: Vehicles to manage, discovered from the account's associations if not provided
+        """
+        self.username = username
+        self.password = password
+        self.vehicle_ids = list(vehicle_ids) if vehicle_ids is not None else []
+        self._discover = vehicle_ids is None
+        # Consecutive failed refreshes and when the next attempt is allowed, so bad credentials don't log in every pass
+        self._auth_failures = 0
+        self._retry_at: Optional[pd.Timestamp] = None
+
+    def has_valid_token(self) -> bool:
+        """
+        Whether the account has a token that hasn't expired yet
+        """
+        return self.access_token is not None and self.expires_at > pd.Timestamp.utcnow()
+
+
+class FleetManager:
+    """
+    Shards many accounts' vehicles across worker processes and merges their results
+    Use as a context manager (or call start()/stop()) so the worker processes are cleaned up
+    """
+    processes: int
+    threads_per_worker: int
+    refresh_margin: pd.Timedelta
+    refresh_interval: float
+    timeout: float
+
+    def __init__(self, processes: Optional[int] = None, threads_per_worker: int = 4, refresh_margin_minutes: float = 5, timeout: float = 300, auth_flow: Optional[Callable[[str, str], dict]] = None, refresh_interval: float = 30):
+        """
+        :param processes: Number of worker processes (defaults to the CPU count)
+        :param threads_per_worker: Concurrent upstream requests per worker
+        :param refresh_margin_minutes: Tokens expiring within this many minutes are refreshed by the background refresher
+        :param timeout: Seconds to wait for all workers to report back for one poll/trip request
+        :param auth_flow: Callable taking (username, password) and returning {"access_token", "expires_at"},
+                          defaults to POC().attempt_auth_flow (DB cached token, Selenium login when needed)
+        :param refresh_interval: Seconds between background token refresh passes
+        """
+        self.processes = processes or multiprocessing.cpu_count()
+        self.threads_per_worker = threads_per_worker
+        self.refresh_margin = pd.Timedelta(minutes=refresh_margin_minutes)
+        self.timeout = timeout
+        self.refresh_interval = refresh_interval
+        if auth_flow is None:
+            from POC.poc import POC
+            auth_flow = POC().attempt_auth_flow
+        self.auth_flow = auth_flow
+        self.accounts: Dict[str, Account] = {}
+        # (account username, vehicle_id) -> worker index
+        self.assignments: Dict[Tuple[str, str], int] = {}
+        self._workers: List[multiprocessing.Process] = []
+        self._task_queues: List[multiprocessing.Queue] = []
+        self._results: Optional[multiprocessing.Queue] = None
+        self._request_ids = itertools.count()
+        # The default auth flow shares one DB connection and drives a browser, so logins are never run concurrently
+        self._auth_lock = threading.Lock()
+        self._refresher: Optional[threading.Thread] = None
+        self._refresh_wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    #Lifecycle
+    def start(self) -> None:
+        """
+        Starts the worker processes and the background token refresher
+        """
+        if self._workers:
+            return
+        self._stopping.clear()
+        self._results = multiprocessing.Queue()
+        base_urls = (API.hapi_base_url, API.idam_base_url)
+        for worker_index in range(self.processes):
+            tasks = multiprocessing.Queue()
+            worker = multiprocessing.Process(target=_worker_main, args=(worker_index, tasks, self._results, self.threads_per_worker, base_urls), daemon=True)
+            worker.start()
+            self._task_queues.append(tasks)
+            self._workers.append(worker)
+        # Started after the workers are forked, a fork while it holds a lock would leave the lock held in the child
+        self._refresher = threading.Thread(target=self._refresh_loop, name="fleet-token-refresher", daemon=True)
+        self._refresher.start()
+
+    def stop(self) -> None:
+        """
+        Asks every worker (and the token refresher) to exit and waits for them
+        """
+        self._stopping.set()
+        self._refresh_wakeup.set()
+        if self._refresher is not None:
+            # A login in progress is not interrupted, the daemon thread is left to finish it
+            self._refresher.join(timeout=10)
+            self._refresher = None
+        for tasks in self._task_queues:
+            tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers, self._task_queues, self._results = [], [], None
+
+    def __enter__(self) -> "FleetManager":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    #Accounts
+    def add_account(self, username: str, password: str, vehicle_ids: Optional[List[str]] = None) -> Account:
+        """
+        Adds (or replaces) an account, authenticates it and rebalances the vehicle assignments
+        The account is only registered once authentication (and vehicle discovery) succeeds, a failure is raised to the
+        caller and leaves the fleet unchanged
+        :param username: Spark username
+        :param password: Spark password
+        :param vehicle_ids: Vehicles to manage, discovered from the account's associations if not provided
+        :return: The account
+        """
+        account = Account(username, password, vehicle_ids)
+        self._ensure_token(account)
+        if account._discover:
+            account.vehicle_ids = API(account.access_token).all_associated_vehicles()
+        self.accounts[username] = account
+        self.rebalance()
+        return account
+
+    def remove_account(self, username: str) -> None:
+        """
+        Removes an account and rebalances its vehicles' workers
+        :param username: Spark username
+        """
+        self.accounts.pop(username, None)
+        self.rebalance()
+
+    def refresh_vehicles(self) -> None:
+        """
+        Re-reads the associated vehicles of every account that was added without an explicit vehicle list
+        Accounts whose token or associations can't be fetched keep their current vehicles, the failure is recorded in
+        the account's vehicles_error
+        """
+        for account in list(self.accounts.values()):
+            if account._discover and account.has_valid_token():
+                try:
+                    account.vehicle_ids = API(account.access_token).all_associated_vehicles()
+                    account.vehicles_error = None
+                except Exception as e:
+                    account.vehicles_error = str(e)
+        self.rebalance()
+
+    def _ensure_token(self, account: Account) -> None:
+        """
+        Authenticates the account if it has no token or the token expires within refresh_margin
+        """
+        if account.access_token is not None and account.expires_at - pd.Timestamp.utcnow() > self.refresh_margin:
+            return
+        with self._auth_lock:
+            credentials = self.auth_flow(account.username, account.password)
+        account.access_token = credentials["access_token"]
+        expires_at = pd.Timestamp(credentials["expires_at"])
+        account.expires_at = expires_at.tz_localize("UTC") if expires_at.tzinfo is None else expires_at
+
+    def refresh_tokens(self) -> None:
+        """
+        Refreshes every account token that is missing or expires within refresh_margin
+        A failed login is recorded in the account's auth_error and doesn't stop the other accounts from refreshing,
+        the account is retried with an exponential backoff (capped at MAX_AUTH_BACKOFF)
+        """
+        now = pd.Timestamp.utcnow()
+        for account in list(self.accounts.values()):
+            if account._retry_at is not None and now < account._retry_at:
+                continue
+            try:
+                self._ensure_token(account)
+                account.auth_error, account._auth_failures, account._retry_at = None, 0, None
+            except Exception as e:
+                account.auth_error = str(e)
+                account._auth_failures += 1
+                backoff = min(pd.Timedelta(seconds=self.refresh_interval) * 2 ** (account._auth_failures - 1), MAX_AUTH_BACKOFF)
+                account._retry_at = pd.Timestamp.utcnow() + backoff
+
+    def _refresh_loop(self) -> None:
+        """
+        Background refresher: runs refresh_tokens every refresh_interval seconds (or sooner when woken by a dispatch
+        that found a stale token) so logins never hold up polling
+        """
+        while not self._stopping.is_set():
+            self.refresh_tokens()
+            self._refresh_wakeup.wait(self.refresh_interval)
+            self._refresh_wakeup.clear()
+
+    #Sharding
+    def rebalance(self) -> None:
+        """
+        Assigns every managed vehicle to a worker, moving as few existing assignments as possible
+        Worker loads end up within one vehicle of each other, and new vehicles prefer a worker that already holds
+        vehicles from the same account
+        """
+        units = [(account.username, vehicle_id) for account in self.accounts.values() for vehicle_id in account.vehicle_ids]
+        capacity = max(1, math.ceil(len(units) / self.processes))
+        loads = [0] * self.processes
+        assignments: Dict[Tuple[str, str], int] = {}
+        unassigned = []
+        for unit in units:
+            worker_index = self.assignments.get(unit)
+            if worker_index is not None and worker_index < self.processes and loads[worker_index] < capacity:
+                assignments[unit] = worker_index
+                loads[worker_index] += 1
+            else:
+                unassigned.append(unit)
+        for unit in unassigned:
+            account_workers = {worker_index for (username, _), worker_index in assignments.items() if username == unit[0]}
+            candidates = [worker_index for worker_index in account_workers if loads[worker_index] < capacity]
+            worker_index = min(candidates or range(self.processes), key=lambda index: loads[index])
+            assignments[unit] = worker_index
+            loads[worker_index] += 1
+        # Removals can leave workers idle while others sit at capacity, level them to within one vehicle
+        while max(loads) - min(loads) > 1:
+            busiest, idlest = loads.index(max(loads)), loads.index(min(loads))
+            unit = next(unit for unit in reversed(list(assignments)) if assignments[unit] == busiest)
+            assignments[unit] = idlest
+            loads[busiest] -= 1
+            loads[idlest] += 1
+        self.assignments = assignments
+
+    def worker_loads(self) -> List[int]:
+        """
+        Number of vehicles assigned to each worker
+        """
+        loads = [0] * self.processes
+        for worker_index in self.assignments.values():
+            loads[worker_index] += 1
+        return loads
+
+    #Work
+    def _dispatch(self, task: tuple) -> Dict[str, Dict[str, dict]]:
+        """
+        Sends each worker the jobs for its assigned vehicles and merges the results
+        Tokens are kept current by the background refresher, vehicles of an account without a valid token are reported
+        as {"error": message} instead of being dispatched
+        :return: {account username: {vehicle_id: results}}
+        """
+        if not self._workers:
+            raise RuntimeError("FleetManager workers are not running, call start() or use it as a context manager")
+        accounts = dict(self.accounts)
+        merged: Dict[str, Dict[str, dict]] = {username: {} for username in accounts}
+        jobs: Dict[int, list] = {}
+        for (username, vehicle_id), worker_index in self.assignments.items():
+            account = accounts.get(username)
+            if account is None:
+                continue
+            if not account.has_valid_token():
+                merged[username][vehicle_id] = {"error": f"No valid token for {username}: {account.auth_error or 'login pending'}"}
+                continue
+            jobs.setdefault(worker_index, []).append((username, account.access_token, vehicle_id))
+        if any(account.expires_at is None or account.expires_at - pd.Timestamp.utcnow() <= self.refresh_margin for account in accounts.values()):
+            self._refresh_wakeup.set()
+        request_id = next(self._request_ids)
+        for worker_index, worker_jobs in jobs.items():
+            self._task_queues[worker_index].put((request_id, worker_jobs, task))
+
+        pending = set(jobs)
+        while pending:
+            try:
+                reply_id, worker_index, batch = self._results.get(timeout=self.timeout)
+            except queue.Empty:
+                break
+            # Replies from an earlier request that timed out are dropped
+            if reply_id != request_id:
+                continue
+            pending.discard(worker_index)
+            for username, vehicle_id, results in batch:
+                merged.setdefault(username, {})[vehicle_id] = results
+        for worker_index in pending:
+            for username, _, vehicle_id in jobs[worker_index]:
+                merged[username][vehicle_id] = {"error": f"Worker {worker_index} did not respond within {self.timeout} seconds"}
+        return merged
+
+    def poll(self, endpoints: Optional[List[str]] = None) -> Dict[str, Dict[str, dict]]:
+        """
+        Polls the given vehicle endpoints for every managed vehicle
+        :param endpoints: Endpoint names (query_* without the prefix), all must take a vehicle ID
+        :return: {account username: {vehicle_id: {endpoint: response or {"error": message}}}}
+        """
+        return self._dispatch(("poll", list(endpoints or DEFAULT_POLL_ENDPOINTS)))
+
+    def process_trips(self, since: str, until: str, handler: Callable[[dict], object] = trip_summary) -> Dict[str, Dict[str, dict]]:
+        """
+        Fetches and processes a trip week for every managed vehicle inside the workers
+        :param since: Start date of the trip week (yyyy-mm-dd), must be Sunday
+        :param until: End date of the trip week (yyyy-mm-dd), must be following Saturday
+        :param handler: Module level (picklable) function run on each raw trips response, its return value is sent back
+        :return: {account username: {vehicle_id: {"trips": handler result or {"error": message}}}}
+        """
+        return self._dispatch(("trips", since, until, handler))
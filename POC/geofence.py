@@ -0,0 +1,347 @@
+from typing import Dict, List, Optional, Tuple, Union
+from modules.hsparkapi import codec, models
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_M: float = 6371008.8
+
+# Key names seen for coordinates across the Spark endpoints, checked in order (shared with the typed models)
+LAT_KEYS: Tuple[str, ...] = models.Coordinates.latitude.keys
+LNG_KEYS: Tuple[str, ...] = models.Coordinates.longitude.keys
+
+
+def _coordinate(obj, keys: Tuple[str, ...]) -> Optional[float]:
+    """
+    Returns the first present coordinate value from obj, or None
+    """
+    for key in keys:
+        if key in obj and obj[key] is not None:
+            return float(obj[key])
+    return None
+
+
+class Geofence:
+    """
+    A single circular or polygonal geofence
+    Polygons are stored as arrays of vertex coordinates, circles as a center and radius in meters
+    Polygons spanning more than 180 degrees of longitude are taken to cross the antimeridian, their negative longitudes
+    are stored (and tested) shifted by +360 so the polygon is contiguous
+    """
+    id: str
+    name: str
+    vertices_lat: Optional[np.ndarray] = None
+    vertices_lng: Optional[np.ndarray] = None
+    crosses_antimeridian: bool = False
+    center: Optional[Tuple[float, float]] = None
+    radius_m: Optional[float] = None
+
+    def __init__(self, id: str, name: str, vertices: Optional[List[Tuple[float, float]]] = None, center: Optional[Tuple[float, float]] = None, radius_m: Optional[float] = None):
+        """
+        Creates a polygon (vertices) or circle (center and radius_m) geofence
+        :param id: Geofence ID
+        :param name: Display name
+        :param vertices: Polygon vertices as (lat, lng)
+        :param center: Circle center as (lat, lng)
+        :param radius_m: Circle radius in meters
+        """
+        self.id = id
+        self.name = name
+        if vertices is not None:
+            if len(vertices) < 3:
+                raise ValueError(f"Geofence {id} polygon needs at least 3 vertices")
+            self.vertices_lat = np.array([vertex[0] for vertex in vertices], dtype=np.float64)
+            self.vertices_lng = np.array([vertex[1] for vertex in vertices], dtype=np.float64)
+            if self.vertices_lng.max() - self.vertices_lng.min() > 180:
+                self.crosses_antimeridian = True
+                self.vertices_lng = np.where(self.vertices_lng < 0, self.vertices_lng + 360, self.vertices_lng)
+        elif center is not None and radius_m is not None:
+            self.center = (float(center[0]), float(center[1]))
+            self.radius_m = float(radius_m)
+        else:
+            raise ValueError(f"Geofence {id} needs either vertices or a center and radius")
+
+    def bounds(self) -> Tuple[float, float, float, float]:
+        """
+        Bounding box of the geofence
+        The longitudes can fall outside [-180, 180] for fences crossing the antimeridian, in which case max_lng > 180
+        or min_lng < -180 and the box wraps around
+        :return: (min_lat, min_lng, max_lat, max_lng)
+        """
+        if self.center is None:
+            return self.vertices_lat.min(), self.vertices_lng.min(), self.vertices_lat.max(), self.vertices_lng.max()
+        lat, lng = self.center
+        dlat = np.degrees(self.radius_m / EARTH_RADIUS_M)
+        # Widen the longitude span by latitude, clamped so fences near the poles don't divide by ~0
+        dlng = dlat / max(np.cos(np.radians(lat)), 1e-6)
+        return lat - dlat, lng - dlng, lat + dlat, lng + dlng
+
+    def contains(self, lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+        """
+        Vectorized containment test
+        :param lat: Latitudes of the points to test
+        :param lng: Longitudes of the points to test
+        :return: Boolean array, True where the point is inside the geofence
+        """
+        if self.center is not None:
+            return haversine_m(lat, lng, self.center[0], self.center[1]) <= self.radius_m
+        if self.crosses_antimeridian:
+            lng = np.where(lng < 0, lng + 360, lng)
+        # Ray casting, looping over edges (few) and vectorizing over points (many)
+        inside = np.zeros(lat.shape, dtype=bool)
+        y1, x1 = self.vertices_lat, self.vertices_lng
+        y2, x2 = np.roll(y1, -1), np.roll(x1, -1)
+        for edge in range(len(y1)):
+            crosses = (y1[edge] > lat) != (y2[edge] > lat)
+            if not crosses.any():
+                continue
+            # crosses guarantees y1 != y2 for the points that matter
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x_at_lat = (x2[edge] - x1[edge]) * (lat - y1[edge]) / (y2[edge] - y1[edge]) + x1[edge]
+            inside ^= crosses & (lng < x_at_lat)
+        return inside
+
+
+def haversine_m(lat: np.ndarray, lng: np.ndarray, lat0: float, lng0: float) -> np.ndarray:
+    """
+    Great-circle distance in meters from each point to (lat0, lng0)
+    """
+    lat, lng = np.radians(lat), np.radians(lng)
+    lat0, lng0 = np.radians(lat0), np.radians(lng0)
+    a = np.sin((lat - lat0) / 2) ** 2 + np.cos(lat) * np.cos(lat0) * np.sin((lng - lng0) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def parse_geofences(payload: Union[models.VehicleGeofences, dict, list, bytes, str]) -> List[Geofence]:
+    """
+    Builds Geofence objects from a query_vehicle_geofence response, reading it through hsparkapi.models
+    Accepts the typed model (API.vehicle_geofences), or the raw response as a list of geofences, a dict wrapping one or
+    a single geofence; entries that are neither a polygon nor a circle, or that are missing a coordinate, are skipped
+    :param payload: Response from query_vehicle_geofence or vehicle_geofences
+    :return: List of geofences
+    """
+    if not isinstance(payload, models.VehicleGeofences):
+        if isinstance(payload, (bytes, str)):
+            payload = codec.loads(payload)
+        payload = models.VehicleGeofences({"geofences": payload} if isinstance(payload, list) else payload)
+    entries = payload.geofences
+    if entries is None:
+        # A dict that doesn't wrap a list is taken to be a single geofence
+        entries = (models.Geofence(payload.raw),) if isinstance(payload.raw, dict) else ()
+    geofences = []
+    for position, entry in enumerate(entries):
+        fence_id = entry.id if entry.id is not None else str(position)
+        name = entry.name if entry.name is not None else fence_id
+        if entry.points:
+            vertices = [(point.latitude, point.longitude) for point in entry.points]
+            if len(vertices) >= 3 and all(lat is not None and lng is not None for lat, lng in vertices):
+                geofences.append(Geofence(fence_id, name, vertices=vertices))
+        elif entry.center is not None and entry.radius is not None:
+            center = entry.center
+            if center.latitude is not None and center.longitude is not None:
+                geofences.append(Geofence(fence_id, name, center=(center.latitude, center.longitude), radius_m=entry.radius))
+    return geofences
+
+
+def location_point(payload: dict) -> Tuple[pd.Timestamp, float, float]:
+    """
+    Extracts (timestamp, lat, lng) from a query_vehicle_location response
+    """
+    timestamp = payload.get("timestamp") or payload.get("lastUpdated")
+    return pd.Timestamp(timestamp) if timestamp else pd.Timestamp.utcnow(), _coordinate(payload, LAT_KEYS), _coordinate(payload, LNG_KEYS)
+
+
+def trip_track(payload: dict) -> pd.DataFrame:
+    """
+    Flattens every per-second point of a query_vehicle_trips response into one time-ordered track
+    :param payload: Raw JSON response from query_vehicle_trips
+    :return: DataFrame with timestamp, lat and lng columns
+    """
+    trips = payload.get("trips", []) if isinstance(payload, dict) else payload
+    timestamps, lats, lngs = [], [], []
+    for trip in trips:
+        for point in trip.get("points", trip.get("route", [])):
+            lat, lng = _coordinate(point, LAT_KEYS), _coordinate(point, LNG_KEYS)
+            if lat is None or lng is None:
+                continue
+            timestamps.append(point.get("timestamp"))
+            lats.append(lat)
+            lngs.append(lng)
+    track = pd.DataFrame({"timestamp": pd.to_datetime(timestamps, utc=True), "lat": lats, "lng": lngs})
+    return track.sort_values("timestamp", kind="stable", ignore_index=True)
+
+
+def _lng_spans(min_lng: float, max_lng: float) -> List[Tuple[float, float]]:
+    """
+    Splits a longitude range that may wrap past +-180 into spans within [-180, 180]
+    """
+    if max_lng - min_lng >= 360:
+        return [(-180.0, 180.0)]
+    lo = (min_lng + 180) % 360 - 180
+    hi = lo + (max_lng - min_lng)
+    if hi <= 180:
+        return [(lo, hi)]
+    return [(lo, 180.0), (-180.0, hi - 360)]
+
+
+class GeofenceIndex:
+    """
+    Uniform grid over the geofence bounding boxes so each point is only tested against fences whose box covers its cell
+    """
+    geofences: List[Geofence]
+    cell_size_deg: float
+
+    def __init__(self, geofences: List[Geofence], cell_size_deg: float = 0.01):
+        """
+        Builds the grid
+        :param geofences: Geofences to index
+        :param cell_size_deg: Grid cell size in degrees (0.01 is roughly 1 km)
+        """
+        self.geofences = geofences
+        self.cell_size_deg = cell_size_deg
+        self._cols = int(np.ceil(360 / cell_size_deg)) + 1
+        # Per fence: the cell key ranges (one per grid row and longitude span) covered by its bounding box
+        self._ranges: List[Tuple[np.ndarray, np.ndarray]] = []
+        for geofence in geofences:
+            min_lat, min_lng, max_lat, max_lng = geofence.bounds()
+            row_lo, row_hi = self._cell(min_lat, 0)[0], self._cell(max_lat, 0)[0]
+            rows = np.arange(row_lo, row_hi + 1, dtype=np.int64)
+            key_lo, key_hi = [], []
+            for span_lo, span_hi in _lng_spans(min_lng, max_lng):
+                col_lo, col_hi = self._cell(0, span_lo)[1], self._cell(0, span_hi)[1]
+                key_lo.append(rows * self._cols + col_lo)
+                key_hi.append(rows * self._cols + col_hi)
+            self._ranges.append((np.concatenate(key_lo), np.concatenate(key_hi)))
+
+    def _cell(self, lat, lng):
+        row = np.floor((np.asarray(lat) + 90) / self.cell_size_deg).astype(np.int64)
+        col = np.floor((np.asarray(lng) + 180) / self.cell_size_deg).astype(np.int64)
+        return row, col
+
+    def contains(self, lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+        """
+        Tests every point against every geofence, using the grid to skip fences whose box doesn't cover the point
+        Points with a missing (NaN) coordinate are not inside any geofence
+        :param lat: Latitudes of the points to test
+        :param lng: Longitudes of the points to test
+        :return: Boolean matrix of shape (points, geofences)
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lng = np.asarray(lng, dtype=np.float64)
+        inside = np.zeros((len(lat), len(self.geofences)), dtype=bool)
+        valid = np.flatnonzero(np.isfinite(lat) & np.isfinite(lng))
+        if not len(valid):
+            return inside
+        row, col = self._cell(lat[valid], lng[valid])
+        keys = row * self._cols + col
+        order = valid[np.argsort(keys, kind="stable")]
+        sorted_keys = np.sort(keys, kind="stable")
+        for fence_index, (geofence, (key_lo, key_hi)) in enumerate(zip(self.geofences, self._ranges)):
+            starts = np.searchsorted(sorted_keys, key_lo, side="left")
+            ends = np.searchsorted(sorted_keys, key_hi, side="right")
+            spans = [order[start:end] for start, end in zip(starts, ends) if end > start]
+            if not spans:
+                continue
+            # A point can only fall in one span per row, but wrapped spans of tiny grids may share cells
+            candidates = np.unique(np.concatenate(spans))
+            inside[candidates, fence_index] = geofence.contains(lat[candidates], lng[candidates])
+        return inside
+
+
+class GeofenceEngine:
+    """
+    Turns batches of positions into enter/exit/dwell events, remembering each vehicle's state between batches
+    so single location polls and whole trip weeks can be fed through the same engine
+    """
+    index: GeofenceIndex
+
+    def __init__(self, geofences: List[Geofence], cell_size_deg: float = 0.01):
+        """
+        :param geofences: Geofences to evaluate against (see parse_geofences)
+        :param cell_size_deg: Grid cell size in degrees
+        """
+        self.index = GeofenceIndex(geofences, cell_size_deg)
+        # vehicle_id -> (inside flags per fence, entered_at per fence)
+        self._state: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def from_response(cls, payload: Union[models.VehicleGeofences, dict, list, bytes, str], cell_size_deg: float = 0.01) -> "GeofenceEngine":
+        """
+        Builds an engine straight from a query_vehicle_geofence response or a VehicleGeofences model
+        """
+        return cls(parse_geofences(payload), cell_size_deg)
+
+    def evaluate(self, vehicle_id: str, timestamps, lat, lng) -> pd.DataFrame:
+        """
+        Evaluates a time-ordered batch of positions for one vehicle
+        The first batch for a vehicle only establishes its state: a fence it starts inside produces no enter event
+        Positions with a missing coordinate are skipped rather than treated as outside every fence
+        :param vehicle_id: Vehicle ID the positions belong to
+        :param timestamps: Position timestamps, ascending
+        :param lat: Latitudes
+        :param lng: Longitudes
+        :return: DataFrame of events with vehicle_id, geofence_id, geofence_name, event (enter/exit/dwell), timestamp and dwell_seconds
+                 A dwell event is emitted alongside each exit, dwell_seconds is the time spent inside
+        """
+        timestamps = pd.to_datetime(pd.Series(timestamps), utc=True).to_numpy()
+        lat = np.asarray(lat, dtype=np.float64)
+        lng = np.asarray(lng, dtype=np.float64)
+        located = np.isfinite(lat) & np.isfinite(lng)
+        if not located.all():
+            timestamps, lat, lng = timestamps[located], lat[located], lng[located]
+        inside = self.index.contains(lat, lng)
+        fence_count = inside.shape[1]
+        if vehicle_id in self._state:
+            previous, entered_at = self._state[vehicle_id]
+        elif len(inside):
+            previous, entered_at = inside[0].copy(), np.full(fence_count, timestamps[0])
+        else:
+            return _events_frame([])
+
+        # Prepend the previous state so transitions across batches are detected by the same diff
+        states = np.vstack([previous, inside]).astype(np.int8)
+        changes = np.diff(states, axis=0)
+        point_index, fence_index = np.nonzero(changes)
+        events = []
+        # nonzero walks row-major, so events come out in time order
+        for point, fence in zip(point_index, fence_index):
+            geofence = self.index.geofences[fence]
+            timestamp = timestamps[point]
+            if changes[point, fence] > 0:
+                entered_at[fence] = timestamp
+                events.append((vehicle_id, geofence.id, geofence.name, "enter", timestamp, None))
+            else:
+                dwell = (timestamp - entered_at[fence]) / np.timedelta64(1, "s")
+                events.append((vehicle_id, geofence.id, geofence.name, "exit", timestamp, None))
+                events.append((vehicle_id, geofence.id, geofence.name, "dwell", timestamp, float(dwell)))
+        if len(inside):
+            self._state[vehicle_id] = (inside[-1].copy(), entered_at)
+        return _events_frame(events)
+
+    def evaluate_location(self, vehicle_id: str, payload: dict) -> pd.DataFrame:
+        """
+        Evaluates a single query_vehicle_location response
+        """
+        timestamp, lat, lng = location_point(payload)
+        return self.evaluate(vehicle_id, [timestamp], [lat], [lng])
+
+    def evaluate_trips(self, vehicle_id: str, payload: dict) -> pd.DataFrame:
+        """
+        Evaluates every per-second point of a query_vehicle_trips response
+        """
+        track = trip_track(payload)
+        return self.evaluate(vehicle_id, track["timestamp"], track["lat"].to_numpy(), track["lng"].to_numpy())
+
+    def currently_inside(self, vehicle_id: str) -> List[str]:
+        """
+        IDs of the geofences the vehicle was inside at its last evaluated position
+        """
+        if vehicle_id not in self._state:
+            return []
+        inside, _ = self._state[vehicle_id]
+        return [geofence.id for geofence, flag in zip(self.index.geofences, inside) if flag]
+
+
+def _events_frame(events: list) -> pd.DataFrame:
+    frame = pd.DataFrame(events, columns=["vehicle_id", "geofence_id", "geofence_name", "event", "timestamp", "dwell_seconds"])
+    frame["timestamp"] = pd.to_datetime(frame["timestamp"], utc=True)
+    return frame
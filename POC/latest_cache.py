@@ -0,0 +1,85 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Hashable, Optional, Tuple
+import time
+
+
+class LatestStateCache:
+    """
+    Thread-safe TTL/LRU cache for the latest response per (user_hash, endpoint, vehicle_id)
+    Entries are dropped by this process's writes (see DB.insert_response_record), writes made by other processes are
+    picked up once the entry expires, so ttl bounds how stale a read can be
+    Readers take a version() before querying and pass it to put, so a value read before a write committed isn't cached
+    after that write's invalidate
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 4096):
+        """
+        :param ttl: Seconds an entry is served for before it is read from the database again
+        :param max_entries: Entries kept before the least recently used ones are evicted
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[Hashable, ...], Tuple[float, Any]]" = OrderedDict()
+        self._lock = Lock()
+        # Bumped by every invalidate, which records it against the key. Only the last max_entries keys are remembered,
+        # _forgotten is the newest version dropped from them and is assumed for keys that aren't
+        self._version = 0
+        self._invalidated: "OrderedDict[Tuple[Hashable, ...], int]" = OrderedDict()
+        self._forgotten = 0
+
+    def get(self, *key: Hashable) -> Optional[Any]:
+        """
+        Returns the cached value for key, or None if it is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def version(self, *key: Hashable) -> int:
+        """
+        Returns the version to pass to put for a value about to be read for key
+        """
+        with self._lock:
+            return self._version
+
+    def put(self, *key_value: Any, version: Optional[int] = None) -> None:
+        """
+        Caches a value, called as put(*key, value)
+        :param version: version() taken before the value was read, the value is not cached if key has been invalidated
+            since then
+        """
+        *key, value = key_value
+        key = tuple(key)
+        with self._lock:
+            if version is not None and self._invalidated.get(key, self._forgotten) > version:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *key: Hashable) -> None:
+        """
+        Drops the cached value for key (if any), and any put for key with an older version
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._version += 1
+            self._invalidated[key] = self._version
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.max_entries:
+                self._forgotten = self._invalidated.popitem(last=False)[1]
+
+    def clear(self) -> None:
+        """
+        Drops every cached value
+        """
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,121 @@
+from typing import Any, List
+from modules.hsparkapi import codec
+import hashlib
+
+# Delta format: {"set": [[path, value], ...], "unset": [path, ...]} where path is a list of dict keys from the root
+# An empty path replaces the whole document, lists are always replaced whole rather than diffed
+
+
+def canonical_json(data: Any) -> bytes:
+    """
+    Serializes data through the shared codec with sorted keys and no whitespace, so equal documents produce the same
+    bytes for a given codec
+    Codecs can format some floats differently, so after switching codecs an unchanged response may be stored once more
+    before deduplication picks up again
+    :param data: JSON-compatible data
+    :return: Canonical UTF-8 JSON
+    """
+    return codec.dumps_bytes(data, sort_keys=True)
+
+
+def content_hash(data: Any) -> str:
+    """
+    Hashes the canonical JSON form of data
+    :param data: JSON-compatible data
+    :return: Hex SHA-256 digest
+    """
+    return canonical_hash(canonical_json(data))
+
+
+def canonical_hash(canonical: bytes) -> str:
+    """
+    Hashes output already produced by canonical_json, for callers that keep the canonical form
+    :param canonical: Canonical UTF-8 JSON
+    :return: Hex SHA-256 digest
+    """
+    return hashlib.sha256(canonical).hexdigest()
+
+
+def diff(old: Any, new: Any) -> dict:
+    """
+    Builds the delta that turns old into new
+    :param old: Previous document
+    :param new: Current document
+    :return: Delta dict (see module comment for the format)
+    """
+    delta = {"set": [], "unset": []}
+    _diff(old, new, [], delta)
+    return delta
+
+
+def _diff(old: Any, new: Any, path: List[str], delta: dict) -> None:
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, value in new.items():
+            if key not in old:
+                delta["set"].append([path + [key], value])
+            elif old[key] != value:
+                _diff(old[key], value, path + [key], delta)
+        for key in old:
+            if key not in new:
+                delta["unset"].append(path + [key])
+    elif old != new:
+        delta["set"].append([path, new])
+
+
+def apply_delta(base: Any, delta: dict) -> Any:
+    """
+    Applies a delta produced by diff() to a copy of base
+    :param base: Document the delta was computed against
+    :param delta: Delta dict
+    :return: Rebuilt document
+    """
+    # Round trip through JSON for a cheap deep copy, base may be shared with other rows
+    result = codec.loads(codec.dumps_bytes(base))
+    for path, value in delta["set"]:
+        if not path:
+            result = value
+            continue
+        parent = result
+        for key in path[:-1]:
+            parent = parent[key]
+        parent[path[-1]] = value
+    for path in delta["unset"]:
+        parent = result
+        for key in path[:-1]:
+            parent = parent[key]
+        parent.pop(path[-1], None)
+    return result
+
+
+def rebuild(responses: list, is_delta: list) -> list:
+    """
+    Rebuilds full documents from a chain of stored rows, oldest first
+    :param responses: Stored response_data values (full documents or deltas)
+    :param is_delta: Whether each stored value is a delta from the row before it
+    :return: List of full documents, None for any delta whose base is not in the chain
+    """
+    rebuilt = []
+    previous = None
+    for response, delta in zip(responses, is_delta):
+        if not delta:
+            previous = response
+        elif previous is not None:
+            previous = apply_delta(previous, response)
+        rebuilt.append(previous)
+    return rebuilt
+
+
+def rebuild_window(responses: list, is_delta: list, base_responses: list, base_is_delta: list) -> list:
+    """
+    Rebuilds a window of stored rows that is ordered newest first, as returned by a history query
+    :param responses: Stored response_data values in the window, newest first
+    :param is_delta: Whether each window value is a delta
+    :param base_responses: Stored values of the rows just older than the window, newest first
+    :param base_is_delta: Whether each base value is a delta
+    :return: Full documents for the window, newest first (None where a delta's base is missing)
+    """
+    # Only the base rows back to (and including) the newest full snapshot are part of the window's chain
+    cut = next((i + 1 for i, delta in enumerate(base_is_delta) if not delta), 0)
+    chain = list(responses) + list(base_responses[:cut])
+    chain_is_delta = list(is_delta) + list(base_is_delta[:cut])
+    return rebuild(chain[::-1], chain_is_delta[::-1])[::-1][:len(responses)]
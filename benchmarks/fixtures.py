@@ -0,0 +1,102 @@
+import datetime
+import json
+import math
+import random
+from pathlib import Path
+from typing import Optional
+
+# Names match the API.query_* methods with the "query_" prefix removed
+FIXTURE_NAMES: list = [
+    "user_self",
+    "user_vehicle_associations",
+    "vehicle_summary",
+    "vehicle_details",
+    "vehicle_health",
+    "vehicle_location",
+    "vehicle_geofence",
+    "vehicle_trips",
+]
+
+
+def synthetic_trips(since: str, days: int = 7, trips_per_day: int = 4, trip_minutes: int = 30, seed: int = 435) -> dict:
+    """
+    Builds a trip week in the shape returned by the trips endpoint, with one point per second of driving
+    :param since: First day of the week (yyyy-mm-dd)
+    :param days: Number of days to generate
+    :param trips_per_day: Number of trips per day
+    :param trip_minutes: Length of each trip in minutes
+    :param seed: Seed for the random walk so payloads are reproducible between runs
+    :return: Trip payload as dict
+    """
+    rng = random.Random(seed)
+    start = datetime.datetime.strptime(since, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+    lat, lng = 38.9072, -77.0369
+    trips = []
+    for day in range(days):
+        for trip_num in range(trips_per_day):
+            trip_start = start + datetime.timedelta(days=day, hours=7 + trip_num * 3)
+            points = []
+            direction = rng.uniform(0, 360)
+            for second in range(trip_minutes * 60):
+                speed = max(0.0, min(120.0, 50 + rng.gauss(0, 15)))
+                direction = (direction + rng.gauss(0, 5)) % 360
+                # Convert km/h over one second into degrees, close enough for test data
+                step = speed / 3600 / 111
+                lat += step * math.cos(math.radians(direction))
+                lng += step * math.sin(math.radians(direction))
+                points.append({
+                    "timestamp": (trip_start + datetime.timedelta(seconds=second)).isoformat(),
+                    "latitude": round(lat, 6),
+                    "longitude": round(lng, 6),
+                    "speed": round(speed, 1),
+                    "direction": int(direction),
+                })
+            trips.append({
+                "tripId": f"trip-{day}-{trip_num}",
+                "startTime": points[0]["timestamp"],
+                "endTime": points[-1]["timestamp"],
+                "points": points,
+            })
+    return {"summary": {"tripCount": len(trips), "since": since, "days": days}, "trips": trips}
+
+
+def synthetic_fixtures(vehicle_ids: list, trip_days: int = 7) -> dict:
+    """
+    Builds a stand-in payload for every endpoint when no recorded fixtures are available
+    :param vehicle_ids: Vehicle IDs to report as associated with the account
+    :param trip_days: Number of days of per-second trip data to generate
+    :return: Dict of fixture name to payload
+    """
+    return {
+        "user_self": {"id": "benchmark-user", "email": "benchmark@example.com", "firstName": "Bench", "lastName": "Mark"},
+        "user_vehicle_associations": [{"vehicleId": vehicle_id, "associationStatus": "ASSOCIATED"} for vehicle_id in vehicle_ids],
+        "vehicle_summary": {"odometer": 48213.4, "fuelLevel": 62, "batteryVoltage": 12.6, "ignition": "OFF", "lastUpdated": "2023-01-01T00:00:00Z"},
+        "vehicle_details": [{"clientId": vehicle_ids[0], "make": "Toyota", "model": "Corolla", "year": 2019, "vin": "0" * 17}],
+        "vehicle_health": {"checkEngine": False, "dtcCodes": [], "batteryHealth": "GOOD", "lastUpdated": "2023-01-01T00:00:00Z"},
+        "vehicle_location": {"latitude": 38.9072, "longitude": -77.0369, "speed": 0, "direction": 0, "timestamp": "2023-01-01T00:00:00Z"},
+        "vehicle_geofence": {"geofences": [
+            {"id": "home", "name": "Home", "type": "CIRCLE", "center": {"latitude": 38.9072, "longitude": -77.0369}, "radius": 250},
+            {"id": "work", "name": "Work", "type": "POLYGON", "points": [
+                {"latitude": 38.95, "longitude": -77.10}, {"latitude": 38.95, "longitude": -77.05},
+                {"latitude": 38.90, "longitude": -77.05}, {"latitude": 38.90, "longitude": -77.10},
+            ]},
+        ]},
+        "vehicle_trips": synthetic_trips("2023-01-01", days=trip_days),
+    }
+
+
+def load_fixtures(fixtures_dir: Optional[str] = None, vehicle_ids: Optional[list] = None, trip_days: int = 7) -> dict:
+    """
+    Loads recorded fixtures from {fixtures_dir}/{name}.json, falling back to synthetic payloads for any that are missing
+    :param fixtures_dir: Directory of recorded responses (optional)
+    :param vehicle_ids: Vehicle IDs used for synthetic payloads
+    :param trip_days: Number of days of synthetic trip data
+    :return: Dict of fixture name to payload
+    """
+    fixtures = synthetic_fixtures(vehicle_ids or ["benchmark-vehicle-1"], trip_days=trip_days)
+    if fixtures_dir:
+        for name in FIXTURE_NAMES:
+            path = Path(fixtures_dir) / f"{name}.json"
+            if path.exists():
+                fixtures[name] = json.loads(path.read_text())
+    return fixtures
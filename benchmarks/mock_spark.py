@@ -0,0 +1,94 @@
+import json
+import random
+import threading
+import time
+from typing import Optional
+
+import flask
+from werkzeug.serving import make_server
+
+
+def create_app(fixtures: dict, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0, seed: Optional[int] = None) -> flask.Flask:
+    """
+    Builds a Flask app that stands in for both hapi-plus and idam-plus, serving fixture payloads
+    :param fixtures: Dict of fixture name to payload (see benchmarks.fixtures)
+    :param latency_ms: Base latency added to every response
+    :param jitter_ms: Maximum random latency added on top of latency_ms
+    :param error_rate: Fraction of requests (0-1) that return a non-JSON 500 response
+    :param seed: Seed for latency jitter and error injection
+    :return: Flask app
+    """
+    app = flask.Flask(__name__)
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    # Encode once up front so the stand-in's own serialization cost doesn't show up in the measurements
+    encoded: dict = {name: json.dumps(payload).encode() for name, payload in fixtures.items()}
+
+    def respond(name: str) -> flask.Response:
+        with rng_lock:
+            delay = latency_ms + rng.uniform(0, jitter_ms)
+            fail = rng.random() < error_rate
+        if delay:
+            time.sleep(delay / 1000)
+        if fail:
+            return flask.Response("Injected upstream error", status=500, mimetype="text/plain")
+        return flask.Response(encoded[name], status=200, mimetype="application/json")
+
+    @app.route('/v1/users/self', methods=['GET'])
+    def user_self():
+        return respond("user_self")
+
+    @app.route('/v2/user/associations/', methods=['GET'])
+    def user_vehicle_associations():
+        return respond("user_vehicle_associations")
+
+    @app.route('/v2/devices/<vehicle_id>/current/<kind>', methods=['GET'])
+    def vehicle_current(vehicle_id, kind):
+        if f"vehicle_{kind}" not in encoded:
+            flask.abort(404)
+        return respond(f"vehicle_{kind}")
+
+    @app.route('/v1.0/vehicles', methods=['GET'])
+    def vehicle_details():
+        return respond("vehicle_details")
+
+    @app.route('/v1.1/devices/<vehicle_id>/geofence', methods=['GET'])
+    def vehicle_geofence(vehicle_id):
+        return respond("vehicle_geofence")
+
+    @app.route('/v2/devices/<vehicle_id>/trips', methods=['GET'])
+    def vehicle_trips(vehicle_id):
+        return respond("vehicle_trips")
+
+    return app
+
+
+class BackgroundServer:
+    """
+    Runs a WSGI app on a local port in a daemon thread for the duration of a benchmark
+    """
+
+    def __init__(self, app, host: str = "127.0.0.1", port: int = 0):
+        """
+        Binds the server, port 0 lets the OS pick a free port
+        :param app: WSGI app to serve
+        :param host: Interface to bind to
+        :param port: Port to bind to
+        """
+        self.server = make_server(host, port, app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """
+        Base URL of the running server
+        """
+        return f"http://{self.server.host}:{self.server.port}"
+
+    def __enter__(self) -> "BackgroundServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.thread.join()
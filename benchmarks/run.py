@@ -0,0 +1,340 @@
+"""
+Offline benchmark and load-test suite
+
+Runs every measurement against a local stand-in for hapi-plus/idam-plus (see benchmarks.mock_spark) so results can be
+compared between changes without touching the production service. Run from the repository root:
+
+    python -m benchmarks.run --suites api,flask --output bench.json
+    python -m benchmarks.run --compare bench.json
+
+The DB suite needs the same DB_* environment variables as POC.db.DB and writes under a dedicated user_hash that is
+deleted afterwards.
+"""
+# Bring parent directory into scope to import modules dir without having to install the package
+import os
+import sys
+import pathlib
+sys.path.append(str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent))
+
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import requests
+
+from benchmarks.fixtures import load_fixtures
+from benchmarks.mock_spark import BackgroundServer, create_app
+from modules.hsparkapi import API
+
+SUITES: List[str] = ["api", "flask", "db", "memory"]
+VEHICLE_ID: str = "benchmark-vehicle-1"
+# Outside the range POC.constant_hash can produce (32 bits) so benchmark rows never collide with a real user
+BENCHMARK_USER_HASH: int = 2**32 + 435
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    """
+    Reduces raw per-call latencies into the stats written to the results file
+    :param latencies: Latency of each successful call in seconds
+    :param errors: Number of failed calls
+    :param elapsed: Wall time of the whole run in seconds
+    :return: Dict of summary statistics, latencies in milliseconds
+    """
+    ms = sorted(latency * 1000 for latency in latencies)
+
+    def pct(p: float) -> Optional[float]:
+        return round(ms[min(len(ms) - 1, int(len(ms) * p))], 3) if ms else None
+
+    return {
+        "calls": len(ms) + errors,
+        "errors": errors,
+        "throughput_per_s": round((len(ms) + errors) / elapsed, 3) if elapsed else None,
+        "mean_ms": round(statistics.fmean(ms), 3) if ms else None,
+        "p50_ms": pct(0.50),
+        "p90_ms": pct(0.90),
+        "p99_ms": pct(0.99),
+        "max_ms": round(ms[-1], 3) if ms else None,
+    }
+
+
+def run_concurrent(call: Callable[[], object], requests_per_level: int, concurrency: int) -> dict:
+    """
+    Runs call requests_per_level times across a thread pool and summarizes the latency
+    :param call: Zero argument callable to time, raising counts as an error
+    :param requests_per_level: Total number of calls
+    :param concurrency: Number of worker threads
+    :return: Summary dict from summarize()
+    """
+    def timed(_) -> Optional[float]:
+        start = time.perf_counter()
+        try:
+            call()
+        except Exception:
+            return None
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(requests_per_level)))
+    elapsed = time.perf_counter() - start
+    latencies = [result for result in results if result is not None]
+    return summarize(latencies, len(results) - len(latencies), elapsed)
+
+
+def api_calls(api: API) -> dict:
+    """
+    One zero argument callable per API.query_* endpoint
+    :param api: API instance pointed at the stand-in
+    :return: Dict of endpoint name to callable
+    """
+    calls = {}
+    for method in dir(API):
+        if not method.startswith("query_"):
+            continue
+        endpoint = method[len("query_"):]
+        bound = getattr(api, method)
+        if endpoint == "vehicle_trips":
+            calls[endpoint] = lambda bound=bound: bound(VEHICLE_ID, "2023-01-01", "2023-01-07")
+        elif "vehicleId" in bound.__code__.co_varnames:
+            calls[endpoint] = lambda bound=bound: bound(VEHICLE_ID)
+        else:
+            calls[endpoint] = bound
+    return calls
+
+
+def bench_api(args, mock_url: str) -> dict:
+    """
+    Throughput and latency of hsparkapi.API against the stand-in at each concurrency level
+    """
+    api = API("Bearer benchmark", hapi_base_url=mock_url, idam_base_url=mock_url)
+    results = {}
+    for endpoint, call in api_calls(api).items():
+        per_level = {}
+        for concurrency in args.concurrency:
+            count = args.trip_requests if endpoint == "vehicle_trips" else args.requests
+            per_level[str(concurrency)] = run_concurrent(call, count, concurrency)
+        results[endpoint] = per_level
+    return results
+
+
+def bench_flask(args, mock_url: str) -> dict:
+    """
+    Route latency of flask_backend under concurrent load, with its API calls pointed at the stand-in
+    """
+    from flask_backend.flask_backend import app as backend_app
+
+    # flask_backend builds its own API objects, so redirect them through the class level defaults
+    API.hapi_base_url = mock_url
+    API.idam_base_url = mock_url
+    routes = {
+        "ping": lambda url: requests.get(f"{url}/ping"),
+        "available_endpoints": lambda url: requests.get(f"{url}/query/available_endpoints"),
+        "query_user_vehicle_associations": lambda url: requests.post(f"{url}/query/user_vehicle_associations", headers={"Authorization": "Bearer benchmark"}, json={}),
+        "query_vehicle_summary": lambda url: requests.post(f"{url}/query/vehicle_summary", headers={"Authorization": "Bearer benchmark"}, json={"vehicleId": VEHICLE_ID}),
+        "query_vehicle_location": lambda url: requests.post(f"{url}/query/vehicle_location", headers={"Authorization": "Bearer benchmark"}, json={"vehicleId": VEHICLE_ID}),
+    }
+    results = {}
+    with BackgroundServer(backend_app) as backend:
+        for route, call in routes.items():
+            results[route] = {
+                str(concurrency): run_concurrent(lambda: call(backend.url).raise_for_status(), args.requests, concurrency)
+                for concurrency in args.concurrency
+            }
+    return results
+
+
+def bench_db(args, fixtures: dict) -> dict:
+    """
+    Insert and history query timing for POC.db.DB against the Postgres configured in the environment
+    """
+    from POC.db import DB
+
+    db = DB()
+    db.ensure_schema()
+    results = {}
+    try:
+        for endpoint in ["vehicle_summary", "vehicle_location", "vehicle_trips"]:
+            # Each insert carries a new counter so it is stored as a changed response rather than deduplicated
+            fixture = fixtures[endpoint]
+            start_dt = datetime.datetime(2023, 1, 1)
+            latencies = []
+            start = time.perf_counter()
+            for i in range(args.db_records):
+                call_start = time.perf_counter()
+                db.insert_response_record(
+                    user_hash=BENCHMARK_USER_HASH,
+                    retrieve_dt_tm=(start_dt + datetime.timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S"),
+                    endpoint=endpoint,
+                    response_data={**fixture, "benchmark_seq": i},
+                    vehicle_id=VEHICLE_ID,
+                )
+                latencies.append(time.perf_counter() - call_start)
+            results[f"insert_{endpoint}"] = summarize(latencies, 0, time.perf_counter() - start)
+
+            for record_cnt in [1, 10, 100]:
+                latencies = []
+                start = time.perf_counter()
+                for _ in range(args.db_queries):
+                    call_start = time.perf_counter()
+                    db.get_endpoint_response(BENCHMARK_USER_HASH, endpoint, record_cnt, vehicle_id=VEHICLE_ID)
+                    latencies.append(time.perf_counter() - call_start)
+                results[f"history_{endpoint}_{record_cnt}"] = summarize(latencies, 0, time.perf_counter() - start)
+    finally:
+        db.execute("DELETE FROM spark.public.response_data WHERE user_hash = :user_hash", commit=True, parameters={"user_hash": BENCHMARK_USER_HASH})
+        db.execute("DELETE FROM spark.public.response_latest WHERE user_hash = :user_hash", commit=True, parameters={"user_hash": BENCHMARK_USER_HASH})
+    return results
+
+
+class _OfflineStub:
+    """
+    Stands in for POC.db.DB and POC.poc.POC in the memory suite so sessions never touch Postgres or Selenium
+    Every method accepts any arguments and returns None
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name: str):
+        return lambda *args, **kwargs: None
+
+
+async def _measure_sessions(session_count: int) -> dict:
+    """
+    Opens session_count Shiny sessions of front_end over mock connections and measures the memory they hold
+    Relies on shiny's MockConnection and App._create_session, which are internal to the pinned shiny version
+    Raises if any session fails, so a crashed server function is never reported as a measurement
+    """
+    from shiny._connection import MockConnection
+    import front_end
+
+    # front_end enables debug logging, which would echo every message sent over the mock connections
+    front_end.app._debug = False
+    stubbed = {"DB": front_end.DB, "POC": front_end.POC}
+    front_end.DB = front_end.POC = _OfflineStub
+    errors: List[str] = []
+    opened = []
+    try:
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(session_count):
+            conn = MockConnection()
+            session = front_end.app._create_session(conn)
+            # Shiny reports server() exceptions through this and then closes the session
+            session._send_error_response = errors.append
+            conn.cause_receive(json.dumps({"method": "init", "data": {}}))
+            opened.append((conn, asyncio.create_task(session._run())))
+        # Let every session process its init message and run the server function
+        await asyncio.sleep(0.5)
+        after, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # A healthy session is still waiting for its next message
+        closed = sum(task.done() for _, task in opened)
+        for conn, task in opened:
+            conn.cause_disconnect()
+        await asyncio.gather(*(task for _, task in opened), return_exceptions=True)
+    finally:
+        front_end.DB, front_end.POC = stubbed["DB"], stubbed["POC"]
+    if errors or closed:
+        raise RuntimeError(f"{max(len(errors), closed)} of {session_count} sessions failed: {errors[0] if errors else 'closed early'}")
+    return {
+        "sessions": session_count,
+        "bytes_per_session": (after - before) // session_count,
+        "peak_bytes": peak,
+    }
+
+
+def bench_memory(args) -> dict:
+    """
+    Per-session Python heap usage of front_end
+    """
+    return asyncio.run(_measure_sessions(args.sessions))
+
+
+def compare(baseline: dict, current: dict, path: str = "") -> list:
+    """
+    Walks two results files and reports every numeric metric that changed
+    :param baseline: Earlier results
+    :param current: Results to compare against the baseline
+    :param path: Key path prefix used for reporting
+    :return: List of (metric path, baseline value, current value, percent change)
+    """
+    changes = []
+    for key, value in current.items():
+        if key in ("meta",) or key not in baseline:
+            continue
+        key_path = f"{path}.{key}" if path else key
+        if isinstance(value, dict) and isinstance(baseline[key], dict):
+            changes.extend(compare(baseline[key], value, key_path))
+        elif isinstance(value, (int, float)) and isinstance(baseline[key], (int, float)) and baseline[key]:
+            changes.append((key_path, baseline[key], value, round((value - baseline[key]) / baseline[key] * 100, 2)))
+    return changes
+
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline benchmarks against a local Spark API stand-in")
+    parser.add_argument("--suites", default="api,flask,memory", help=f"Comma separated subset of {','.join(SUITES)}")
+    parser.add_argument("--concurrency", default="1,4,16", type=lambda s: [int(c) for c in s.split(",")], help="Comma separated concurrency levels")
+    parser.add_argument("--requests", default=200, type=int, help="Calls per endpoint per concurrency level")
+    parser.add_argument("--trip-requests", default=10, type=int, help="Calls per concurrency level for the (large) trips endpoint")
+    parser.add_argument("--trip-days", default=7, type=int, help="Days of per-second data in the synthetic trip payload")
+    parser.add_argument("--fixtures-dir", default=None, help="Directory of recorded {endpoint}.json payloads, synthetic payloads fill any gaps")
+    parser.add_argument("--latency-ms", default=0, type=float, help="Latency added by the stand-in to every response")
+    parser.add_argument("--jitter-ms", default=0, type=float, help="Random latency added on top of --latency-ms")
+    parser.add_argument("--error-rate", default=0, type=float, help="Fraction of stand-in responses that fail with a 500")
+    parser.add_argument("--seed", default=435, type=int, help="Seed for jitter and error injection")
+    parser.add_argument("--db-records", default=200, type=int, help="Records inserted per endpoint in the db suite")
+    parser.add_argument("--db-queries", default=50, type=int, help="History queries per record count in the db suite")
+    parser.add_argument("--sessions", default=20, type=int, help="Shiny sessions opened in the memory suite")
+    parser.add_argument("--output", default=None, help="Write results JSON here instead of stdout")
+    parser.add_argument("--compare", default=None, help="Baseline results JSON to compare this run against")
+    args = parser.parse_args(argv)
+    args.suites = [suite.strip() for suite in args.suites.split(",") if suite.strip()]
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suites: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv: Optional[list] = None) -> dict:
+    args = parse_args(argv)
+    fixtures = load_fixtures(args.fixtures_dir, [VEHICLE_ID], trip_days=args.trip_days)
+    results = {
+        "meta": {
+            "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        }
+    }
+    mock_app = create_app(fixtures, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate, seed=args.seed)
+    with BackgroundServer(mock_app) as mock:
+        if "api" in args.suites:
+            results["api"] = bench_api(args, mock.url)
+        if "flask" in args.suites:
+            results["flask"] = bench_flask(args, mock.url)
+    if "db" in args.suites:
+        results["db"] = bench_db(args, fixtures)
+    if "memory" in args.suites:
+        results["memory"] = bench_memory(args)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        pathlib.Path(args.output).write_text(output)
+    else:
+        print(output)
+    if args.compare:
+        baseline = json.loads(pathlib.Path(args.compare).read_text())
+        for metric, before, after, change in compare(baseline, results):
+            print(f"{metric}: {before} -> {after} ({change:+}%)", file=sys.stderr)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -6,16 +6,64 @@ sys.path.append(str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))).pa
 
 import flask
 import inspect
+import time
 from typing import List
 from modules.hsparkapi.api import API
 from modules.hsparkapi.auth import Auth
+from modules.hsparkapi.metrics import metrics
+from modules.hsparkapi import codec
+from flask.json.provider import DefaultJSONProvider
 from POC.db import DB
 from POC.poc import POC
 
+class CodecJSONProvider(DefaultJSONProvider):
+    """
+    Routes flask.jsonify and request.json through the shared hsparkapi JSON codec
+    Dates, dataclasses etc. still go through Flask's default handler and sort_keys/compact are honoured, so the output
+    matches the stock provider except that non-ASCII text is written as UTF-8 rather than \\u escapes
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        if kwargs.get("indent") is not None:
+            # The codec only writes compact JSON
+            return super().dumps(obj, **kwargs)
+        return codec.dumps(obj, sort_keys=kwargs.get("sort_keys", self.sort_keys), default=kwargs.get("default", self.default))
+
+    def loads(self, s, **kwargs):
+        return codec.loads(s)
+
+    def response(self, *args, **kwargs) -> flask.Response:
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            # Pretty printed output goes through the stock provider
+            return super().response(*args, **kwargs)
+        # Encode straight to bytes rather than building a str and having the response re-encode it
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(codec.dumps_bytes(obj, sort_keys=self.sort_keys, default=self.default) + b"\n", mimetype=self.mimetype)
+
 app = flask.Flask(__name__)
+app.json = CodecJSONProvider(app)
 
 auth: Auth = Auth()
 
+@app.before_request
+def _start_timer():
+    """
+    Stores the request start time so the route latency can be recorded once the response is built
+    """
+    if metrics.enabled:
+        flask.g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_latency(response):
+    """
+    Records route latency and status code, labelled by the route pattern rather than the raw path
+    """
+    if metrics.enabled and "request_start" in flask.g:
+        route = flask.request.url_rule.rule if flask.request.url_rule else "unmatched"
+        metrics.observe("spark_backend_request_seconds", time.perf_counter() - flask.g.request_start, route=route, method=flask.request.method)
+        metrics.inc("spark_backend_responses_total", route=route, status=response.status_code)
+    return response
+
 @app.route('/query/<endpoint>', methods=['POST'])
 def query(endpoint):
     """
@@ -80,6 +128,14 @@ def default_vehicle_id():
     hashed_username = POC().constant_hash(username)
     return flask.jsonify({"data": {"default_vehicle_id": DB().get_default_vehicle_id(hashed_username)}})
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Static route that returns all recorded metrics in the Prometheus text format.
+    Metrics are only recorded when enabled (HSPARKAPI_METRICS=1).
+    """
+    return flask.Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/ping', methods=['GET', 'POST'])
 def ping():
     """
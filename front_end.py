@@ -3,8 +3,8 @@ from POC.db import DB
 from POC.poc import POC
 from shiny import App, reactive, render, ui
 from pathlib import Path
-from datetime import datetime
-import json
+import pandas as pd
+import asyncio
 
 
 
@@ -132,7 +132,7 @@ def server(input, output, session):
         Shows the record count input only if the user selects "Historical Data" or "Current and Historical Data"
         """
         if "Historical" in input.data_options():
-            return ui.input_numeric(id="record_cnt", label="Total Number of Entries to Display", value=3)    
+            return ui.input_numeric(id="record_cnt", label="Total Number of Entries to Display (repeated identical responses are stored once)", value=3)    
         
 
     # Event Handlers
@@ -159,13 +159,37 @@ def server(input, output, session):
 
 
     # Main Logic (Authentication and Querying)
+    # Holds references to in-flight DB writes so they aren't garbage collected before they finish
+    pending_writes: set = set()
+
+    def _log_write_failure(task: asyncio.Task) -> None:
+        """
+        Done callback for background DB writes, drops the task reference and reports any failure to the user
+        """
+        pending_writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            ui.notification_show(
+                (
+                    ui.h3("Response not saved"),
+                    ui.p(f"The response was displayed but could not be stored: {task.exception()}")
+                ),
+                type="warning",
+                session=session
+            )
+
     @output
     @render.table
     @reactive.event(input.query_submit)
-    def results_table():
+    async def results_table():
         """
         Handles querying the API and DB and returning the results to the UI
+        The upstream call, DB write and history query run off the event loop so a slow request doesn't freeze other sessions
         """
+        endpoint: str = input.endpoint()
+        vehicle_id = default_vehicle_id.get() if endpoint.startswith("vehicle_") else None
+        record_cnt: int = input.record_cnt() if "Historical" in input.data_options() else 1
+        results: list = []
+        before_dt_tm = None
 
         # If the Data Option is "Current Data" or "Current and Historical Data", we need to query the API
         if input.data_options().startswith("Current"):
@@ -175,26 +199,45 @@ def server(input, output, session):
             query_methods = {endpoint: getattr(api.get(), f"query_{endpoint}") for endpoint in endpoints}
             
             # Grab method and determine if it uses the vehicleId parameter
-            method = query_methods[input.endpoint()]
+            method = query_methods[endpoint]
             uses_vehId: bool = "vehicleId" in method.__code__.co_varnames
-            resp = method(default_vehicle_id.get()) if uses_vehId else method()
+            # Second resolution and timezone aware, so the current row matches the rows read back from the DB
+            retrieved_at = pd.Timestamp.now(tz="UTC").floor("s")
+            resp = await asyncio.to_thread(method, default_vehicle_id.get()) if uses_vehId else await asyncio.to_thread(method)
             
-            # Insert response into DB
-            db.insert_response_record(
+            # Insert response into DB in the background, the current record is rendered from memory
+            before_dt_tm = retrieved_at.isoformat()
+            task = asyncio.create_task(asyncio.to_thread(
+                db.insert_response_record,
                 user_hash = hashed_user.get(), 
-                retrieve_dt_tm = datetime.now().strftime("%Y-%m-%d %H:%M:%S %Z"),
-                endpoint = input.endpoint(),
-                response_data = json.dumps(resp),
+                retrieve_dt_tm = before_dt_tm,
+                endpoint = endpoint,
+                response_data = resp,
                 vehicle_id = default_vehicle_id.get() if uses_vehId else None
-            )
+            ))
+            pending_writes.add(task)
+            task.add_done_callback(_log_write_failure)
 
-        # Query the DB for the response, only pulling the most recent record if the user selected "Current Data"
-        return db.get_endpoint_response(
-            user_hash=hashed_user.get(),
-            endpoint=input.endpoint(),
-            record_cnt=input.record_cnt() if "Historical" in input.data_options() else 1,
-            vehicle_id=default_vehicle_id.get() if str(input.endpoint()).startswith("vehicle_") else None,
-        )
+            # Match the wide layout returned by DB.get_endpoint_response
+            results.append(pd.merge(pd.DataFrame([resp]), pd.DataFrame({"retrieve_dt_tm": [retrieved_at]}), left_index=True, right_index=True))
+            # An empty record count is passed through as no limit
+            if record_cnt is not None:
+                record_cnt -= 1
+
+        # Only query the DB for historical records, older than the current record if there is one
+        if record_cnt is None or record_cnt > 0:
+            results.append(await asyncio.to_thread(
+                db.get_endpoint_response,
+                user_hash=hashed_user.get(),
+                endpoint=endpoint,
+                record_cnt=record_cnt,
+                vehicle_id=vehicle_id,
+                before_dt_tm=before_dt_tm,
+            ))
+        result = pd.concat(results, ignore_index=True)
+        # History can come back in the DB session's timezone, show every row in UTC
+        result["retrieve_dt_tm"] = pd.to_datetime(result["retrieve_dt_tm"], utc=True)
+        return result
     
 
     @reactive.Effect
@@ -6,4 +6,7 @@ This package provides a Python wrapper for the (unofficial) HARMAN Spark API use
 """
 
 from .api import API
-from .auth import Auth
\ No newline at end of file
+from .auth import Auth
+from .metrics import Metrics, metrics
+from . import codec
+from . import models
@@ -1,4 +1,7 @@
-from typing import Optional, Union
+from typing import List, Optional, Union
+from .metrics import metrics
+from . import codec
+from . import models
 import requests
 
 class API:
@@ -7,6 +10,16 @@ class API:
     """
     #Definitions
     spark_authorization: str
+    hapi_base_url: str = "https://hapi-plus.spark.harman.com"
+    idam_base_url: str = "https://idam-plus.spark.harman.com"
+    associations_path: str = "/v2/user/associations/"
+    vehicle_paths = {
+        'vehicle_summary': '/v2/devices/{vehicleId}/current/summary',
+        'vehicle_details': '/v1.0/vehicles?clientId={vehicleId}',
+        'vehicle_health': '/v2/devices/{vehicleId}/current/health',
+        'vehicle_location': '/v2/devices/{vehicleId}/current/location',
+        'vehicle_geofence': '/v1.1/devices/{vehicleId}/geofence'
+    }
     headers = {
         'authority': 'hapi-plus.spark.harman.com',
         'accept': 'application/json, text/plain, */*',
@@ -28,12 +41,18 @@ class API:
     }
     
     #Constructor
-    def __init__(self, spark_authorization: str):
+    def __init__(self, spark_authorization: str, hapi_base_url: Optional[str] = None, idam_base_url: Optional[str] = None):
         """
         Call API constructor with authorization header
         :param spark_authorization: Authorization header value, "{token_type} {access_token}"
+        :param hapi_base_url: Override for the hapi-plus base URL (e.g. a local stand-in for offline benchmarks)
+        :param idam_base_url: Override for the idam-plus base URL (e.g. a local stand-in for offline benchmarks)
         """
         self.set_spark_authorization(spark_authorization)
+        if hapi_base_url:
+            self.hapi_base_url = hapi_base_url
+        if idam_base_url:
+            self.idam_base_url = idam_base_url
 
     #Setters
     def set_spark_authorization(self, spark_authorization: str):
@@ -42,7 +61,8 @@ class API:
         :param spark_authorization: Authorization header value to set
         """
         self.spark_authorization = spark_authorization
-        self.headers['authorization'] = spark_authorization
+        # Copy rather than mutate the class level dict, which would leak one account's token into every other instance
+        self.headers = {**self.headers, 'authorization': spark_authorization}
     
     #Getters
     def get_spark_authorization(self) -> str: # This is set with the constructor so it should never be None
@@ -51,24 +71,56 @@ class API:
         """
         return self.spark_authorization
 
+    #Requests
+    def _get_bytes(self, endpoint: str, url: str) -> bytes:
+        """
+        Sends a GET request to the given URL and returns the undecoded body, recording latency/status/size metrics
+        :param endpoint: Endpoint name used as the metric label (query_* method name without the prefix)
+        :param url: Full URL to request
+        :return: Response body
+        """
+        with metrics.timer("hsparkapi_request_seconds", endpoint=endpoint):
+            response = requests.get(url, headers=self.headers)
+        if metrics.enabled:
+            metrics.inc("hsparkapi_responses_total", endpoint=endpoint, status=response.status_code)
+            metrics.inc("hsparkapi_response_bytes_total", len(response.content), endpoint=endpoint)
+        return response.content
+
+    def _get(self, endpoint: str, url: str):
+        """
+        Sends a GET request to the given URL and decodes the JSON response
+        The body is decoded straight from bytes with the shared codec (see codec.set_codec)
+        :param endpoint: Endpoint name used as the metric label (query_* method name without the prefix)
+        :param url: Full URL to request
+        :return: Decoded JSON response
+        """
+        return codec.loads(self._get_bytes(endpoint, url))
+
+    def _vehicle_url(self, endpoint: str, vehicleId: str) -> str:
+        """
+        Builds the URL of a per-vehicle endpoint, shared by the query_* methods and the typed accessors
+        :param endpoint: Key of vehicle_paths
+        :param vehicleId: Vehicle ID
+        :return: Full URL
+        """
+        return self.hapi_base_url + self.vehicle_paths[endpoint].format(vehicleId=vehicleId)
+
     #API Endpoints
     def query_user_self(self) -> dict:
         """
         Get information about the user
         :return: JSON response
         """
-        url = "https://idam-plus.spark.harman.com/v1/users/self"
-        response = requests.get(url, headers=self.headers)
-        return response.json()
+        url = f"{self.idam_base_url}/v1/users/self"
+        return self._get("user_self", url)
 
     def query_user_vehicle_associations(self) -> dict:
         """
         Get information about the user's associations
         :return: JSON response
         """
-        url = "https://hapi-plus.spark.harman.com/v2/user/associations/"
-        response = requests.get(url, headers=self.headers)
-        return response.json()
+        url = f"{self.hapi_base_url}{self.associations_path}"
+        return self._get("user_vehicle_associations", url)
 
     def query_vehicle_summary(self, vehicleId: str) -> dict:
         """
@@ -76,9 +128,8 @@ class API:
         :param vehicleId: Vehicle ID
         :return: Raw JSON response from endpoint, as dict
         """
-        url = f"https://hapi-plus.spark.harman.com/v2/devices/{vehicleId}/current/summary"
-        response = requests.get(url, headers=self.headers)
-        return response.json()
+        url = self._vehicle_url("vehicle_summary", vehicleId)
+        return self._get("vehicle_summary", url)
 
     def query_vehicle_details(self, vehicleId: str) -> dict:
         """
@@ -87,9 +138,8 @@ class API:
         :param vehicleId: Vehicle ID (referred to as "clientId" in this endpoint)
         :return: Raw JSON response from endpoint, as dict
         """
-        url = f"https://hapi-plus.spark.harman.com/v1.0/vehicles?clientId={vehicleId}"
-        response = requests.get(url, headers=self.headers)
-        return response.json()
+        url = self._vehicle_url("vehicle_details", vehicleId)
+        return self._get("vehicle_details", url)
     
     def query_vehicle_health(self, vehicleId: str) -> dict:
         """
@@ -97,9 +147,8 @@ class API:
         :param vehicleId: Vehicle ID
         :return: Raw JSON response from endpoint, as dict
         """
-        url = f"https://hapi-plus.spark.harman.com/v2/devices/{vehicleId}/current/health"
-        response = requests.get(url, headers=self.headers)
-        return response.json()
+        url = self._vehicle_url("vehicle_health", vehicleId)
+        return self._get("vehicle_health", url)
 
     def query_vehicle_location(self, vehicleId: str) -> dict:
         """
@@ -107,18 +156,16 @@ class API:
         :param vehicleId: Vehicle ID
         :return: Raw JSON response from endpoint, as dict
         """
-        url = f"https://hapi-plus.spark.harman.com/v2/devices/{vehicleId}/current/location"
-        response = requests.get(url, headers=self.headers)
-        return response.json()
+        url = self._vehicle_url("vehicle_location", vehicleId)
+        return self._get("vehicle_location", url)
     
     def query_vehicle_geofence(self, vehicleId: str) -> dict:
         """
         Get information about the vehicle's geofences (if any)
         :return: Raw JSON response from endpoint, as dict
         """
-        url = f"https://hapi-plus.spark.harman.com/v1.1/devices/{vehicleId}/geofence"
-        response = requests.get(url, headers=self.headers)
-        return response.json()
+        url = self._vehicle_url("vehicle_geofence", vehicleId)
+        return self._get("vehicle_geofence", url)
 
     def query_vehicle_trips(self, vehicleId: str, since: str, until: str, timezone: Optional[str] = "America/Los_Angeles"):
         """
@@ -134,9 +181,57 @@ class API:
         :param timezone: Timezone of the trip
         :return: JSON response
         """
-        url = f"https://hapi-plus.spark.harman.com/v2/devices/{vehicleId}/trips?since={since}&until={until}&timezone={timezone}"
-        response = requests.get(url, headers=self.headers)
-        return response.json()
+        url = f"{self.hapi_base_url}/v2/devices/{vehicleId}/trips?since={since}&until={until}&timezone={timezone}"
+        return self._get("vehicle_trips", url)
+
+    #Typed Models
+    # The undecoded body is handed straight to the model, which decodes it when a field is first read, see models.py
+    def vehicle_associations(self) -> List[models.VehicleAssociation]:
+        """
+        Get the user's vehicle associations as typed models
+        :return: List of VehicleAssociation
+        """
+        return models.parse_associations(self._get_bytes("user_vehicle_associations", f"{self.hapi_base_url}{self.associations_path}"))
+
+    def vehicle_summary(self, vehicleId: str) -> models.VehicleSummary:
+        """
+        Get the vehicle summary as a typed model
+        :param vehicleId: Vehicle ID
+        :return: VehicleSummary
+        """
+        return models.VehicleSummary(self._get_bytes("vehicle_summary", self._vehicle_url("vehicle_summary", vehicleId)))
+
+    def vehicle_details(self, vehicleId: str) -> Optional[models.VehicleDetails]:
+        """
+        Get the vehicle details as a typed model
+        :param vehicleId: Vehicle ID (referred to as "clientId" in this endpoint)
+        :return: VehicleDetails, or None if the vehicle wasn't found
+        """
+        return models.parse_vehicle_details(self._get_bytes("vehicle_details", self._vehicle_url("vehicle_details", vehicleId)))
+
+    def vehicle_health(self, vehicleId: str) -> models.VehicleHealth:
+        """
+        Get the vehicle health as a typed model
+        :param vehicleId: Vehicle ID
+        :return: VehicleHealth
+        """
+        return models.VehicleHealth(self._get_bytes("vehicle_health", self._vehicle_url("vehicle_health", vehicleId)))
+
+    def vehicle_location(self, vehicleId: str) -> models.VehicleLocation:
+        """
+        Get the vehicle location as a typed model
+        :param vehicleId: Vehicle ID
+        :return: VehicleLocation
+        """
+        return models.VehicleLocation(self._get_bytes("vehicle_location", self._vehicle_url("vehicle_location", vehicleId)))
+
+    def vehicle_geofences(self, vehicleId: str) -> models.VehicleGeofences:
+        """
+        Get the vehicle's geofences as a typed model
+        :param vehicleId: Vehicle ID
+        :return: VehicleGeofences
+        """
+        return models.VehicleGeofences(self._get_bytes("vehicle_geofence", self._vehicle_url("vehicle_geofence", vehicleId)))
 
     #Parsing Methods
     def first_associated_vehicle(self) -> Union[str, None]:
@@ -6,6 +6,7 @@ from selenium.webdriver.chrome.service import Service
 import re
 import time
 from typing import Optional
+from .metrics import metrics
 
 class Auth:
     """
@@ -24,6 +25,23 @@ class Auth:
         :param sleep_after_auth_seconds: Number of seconds to sleep after authentication to allow JS to load
         :return: Dict of access_token, expires_at
         """
+        with metrics.timer("hsparkapi_auth_login_seconds"):
+            try:
+                access_details = self._login(username, password, sleep_after_auth_seconds)
+            except Exception:
+                metrics.inc("hsparkapi_auth_logins_total", outcome="failure")
+                raise
+        metrics.inc("hsparkapi_auth_logins_total", outcome="success")
+        return access_details
+
+    def _login(self, username: str, password: str, sleep_after_auth_seconds: float) -> dict:
+        """
+        Drives the portal login with Selenium and parses the token out of the redirect URL
+        :param username: Username to be used for authentication against the Spark API
+        :param password: Password to be used for authentication against the Spark API
+        :param sleep_after_auth_seconds: Number of seconds to sleep after authentication to allow JS to load
+        :return: Dict of access_token, expires_at
+        """
         # Set up Chrome options to run headless with minimal logging
         service = Service()
         chrome_options = Options()
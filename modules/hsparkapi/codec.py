@@ -0,0 +1,106 @@
+from os import getenv
+from typing import Any, Callable, Dict, Optional, Union
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONCodec:
+    """
+    A named pair of JSON encode/decode functions
+    loads accepts str or bytes, dumps_bytes returns UTF-8 bytes so callers writing to a socket can skip the str copy
+    """
+    name: str
+
+    def __init__(self, name: str, loads: Callable[[Union[str, bytes]], Any], dumps_bytes: Callable[..., bytes], dumps: Callable[..., str]):
+        """
+        :param name: Codec name used by set_codec()
+        :param loads: Decoder accepting str or bytes
+        :param dumps_bytes: Encoder returning bytes, takes (obj, sort_keys, default)
+        :param dumps: Encoder returning str, takes (obj, sort_keys, default)
+        """
+        self.name = name
+        self._loads = loads
+        self._dumps_bytes = dumps_bytes
+        self._dumps = dumps
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        """
+        Decodes JSON from str or bytes
+        """
+        return self._loads(data)
+
+    def dumps(self, obj: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> str:
+        """
+        Encodes obj as compact JSON text
+        :param default: Called for objects the codec can't serialize itself (and for all datetimes and dataclasses, so
+                        every codec formats them the same way)
+        """
+        return self._dumps(obj, sort_keys, default)
+
+    def dumps_bytes(self, obj: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+        """
+        Encodes obj as compact UTF-8 JSON bytes
+        :param default: See dumps()
+        """
+        return self._dumps_bytes(obj, sort_keys, default)
+
+
+def _stdlib_dumps(obj: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> str:
+    # ensure_ascii=False matches orjson, the output is UTF-8 either way
+    return json.dumps(obj, sort_keys=sort_keys, separators=(",", ":"), ensure_ascii=False, default=default)
+
+
+STDLIB = JSONCodec("stdlib", json.loads, lambda obj, sort_keys=False, default=None: _stdlib_dumps(obj, sort_keys, default).encode(), _stdlib_dumps)
+CODECS: Dict[str, JSONCodec] = {"stdlib": STDLIB}
+
+if orjson is not None:
+    def _orjson_dumps_bytes(obj: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+        # OPT_NON_STR_KEYS keeps parity with the stdlib, which stringifies int/float/bool dict keys
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        if default is not None:
+            option |= orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        return orjson.dumps(obj, default=default, option=option)
+
+    CODECS["orjson"] = JSONCodec("orjson", orjson.loads, _orjson_dumps_bytes, lambda obj, sort_keys=False, default=None: _orjson_dumps_bytes(obj, sort_keys, default).decode())
+
+
+def set_codec(name: str) -> JSONCodec:
+    """
+    Switches the shared codec used by API, the DB layer and the Flask backend
+    :param name: "orjson" or "stdlib"
+    :return: The selected codec
+    """
+    global active_codec
+    if name not in CODECS:
+        raise ValueError(f"JSON codec {name} is not available, installed codecs: {', '.join(CODECS)}")
+    active_codec = CODECS[name]
+    return active_codec
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """
+    Decodes JSON with the current codec
+    """
+    return active_codec.loads(data)
+
+
+def dumps(obj: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> str:
+    """
+    Encodes JSON text with the current codec
+    """
+    return active_codec.dumps(obj, sort_keys, default)
+
+
+def dumps_bytes(obj: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """
+    Encodes JSON bytes with the current codec
+    """
+    return active_codec.dumps_bytes(obj, sort_keys, default)
+
+
+# Fastest installed codec unless HSPARKAPI_JSON picks one explicitly
+active_codec: JSONCodec = CODECS.get(getenv("HSPARKAPI_JSON", "orjson"), STDLIB)
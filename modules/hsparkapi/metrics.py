@@ -0,0 +1,214 @@
+from bisect import bisect_left
+from os import getenv
+from typing import Callable, Dict, List, Optional, Tuple
+import functools
+import threading
+import time
+
+# Prometheus client defaults, in seconds
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Hook signature: (metric name, labels, start time (epoch seconds), duration (seconds), exception or None)
+Hook = Callable[[str, dict, float, float, Optional[BaseException]], None]
+
+
+class _NoopTimer:
+    """
+    Context manager returned by Metrics.timer() when there is nothing to record
+    """
+
+    def __enter__(self) -> "_NoopTimer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class _Timer:
+    """
+    Context manager that records its duration to a histogram and forwards it to any registered hooks
+    """
+
+    def __init__(self, metrics: "Metrics", name: str, labels: dict):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.start_wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        duration = time.perf_counter() - self.start
+        if self.metrics.enabled:
+            self.metrics.observe(self.name, duration, **self.labels)
+        for hook in tuple(self.metrics.hooks):
+            # A broken hook must not fail (or replace the exception of) the call being timed
+            try:
+                hook(self.name, self.labels, self.start_wall, duration, exc)
+            except Exception as e:
+                print(f"Metrics hook {hook!r} failed for {self.name}: {e!r}")
+
+
+class Metrics:
+    """
+    Minimal thread-safe registry of counters and histograms that can be rendered in the Prometheus text format
+    Disabled by default (set HSPARKAPI_METRICS=1 or call enable()), in which case every call returns immediately
+    """
+    enabled: bool
+    hooks: List[Hook]
+    buckets: Tuple[float, ...]
+
+    def __init__(self, enabled: bool = False, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Initializes an empty registry
+        :param enabled: Whether metrics are recorded
+        :param buckets: Upper bounds (seconds) of the histogram buckets, +Inf is implied
+        """
+        self.enabled = enabled
+        self.hooks = []
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        self._histograms: Dict[str, Dict[tuple, list]] = {}
+
+    def enable(self) -> None:
+        """
+        Starts recording metrics
+        """
+        self.enabled = True
+
+    def disable(self) -> None:
+        """
+        Stops recording metrics, already recorded values are kept
+        """
+        self.enabled = False
+
+    def reset(self) -> None:
+        """
+        Clears all recorded values
+        """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def add_hook(self, hook: Hook) -> None:
+        """
+        Registers a tracing hook that is called after every timed block, whether or not metrics are enabled
+        Exceptions raised by a hook are printed and otherwise ignored
+        :param hook: Callable taking (name, labels, start, duration, exception)
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Hook) -> None:
+        """
+        Unregisters a previously added tracing hook
+        :param hook: Hook to remove
+        """
+        self.hooks.remove(hook)
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        """
+        Increments a counter
+        :param name: Metric name
+        :param amount: Amount to increment by
+        :param labels: Label names and values
+        """
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        Records a value in a histogram
+        :param name: Metric name
+        :param value: Observed value (seconds for latency histograms)
+        :param labels: Label names and values
+        """
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            # Per-bucket counts (last slot is +Inf), then sum
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def timer(self, name: str, **labels):
+        """
+        Context manager that observes the duration of its block in the named histogram
+        :param name: Metric name
+        :param labels: Label names and values
+        :return: Context manager
+        """
+        if not self.enabled and not self.hooks:
+            return _NOOP_TIMER
+        return _Timer(self, name, labels)
+
+    def timed(self, name: str, **labels):
+        """
+        Decorator version of timer()
+        :param name: Metric name
+        :param labels: Label names and values
+        :return: Decorator
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled and not self.hooks:
+                    return func(*args, **kwargs)
+                with _Timer(self, name, labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render_prometheus(self) -> str:
+        """
+        Renders every recorded metric in the Prometheus text exposition format (version 0.0.4)
+        :return: Metrics as text
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float("inf"),), histogram[:-1]):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(float(bound))
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram[-1]}")
+                    lines.append(f"{name}_count{_format_labels(key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(key: tuple) -> str:
+    """
+    Formats label pairs as {name="value",...}, escaping values per the exposition format
+    """
+    if not key:
+        return ""
+    pairs = []
+    for label, value in key:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{label}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+# Shared registry used by API, Auth and anything else that wants to report into the same /metrics output
+metrics = Metrics(enabled=getenv("HSPARKAPI_METRICS", "").lower() in ("1", "true", "yes"))
@@ -0,0 +1,273 @@
+"""
+Typed, compact models for the vehicle endpoints
+
+Each model keeps the response body bytes as received. The first field access decodes the body once and caches every
+modelled field in __slots__ (nested objects become models around their already decoded values), the rest of the
+document is dropped; raw and get() decode it once more and keep the document. An unread model costs roughly the size
+of the JSON rather than a tree of dicts, once its fields are read it holds the JSON plus the field values.
+Fields missing from a response read as None, and anything not modelled is still available through get() or the raw
+property.
+"""
+from typing import Any, Dict, List, Optional, Tuple, Type, Union
+from . import codec
+
+_MISSING = object()
+
+_TRUE_STRINGS = ("true", "1", "yes", "y", "on")
+_FALSE_STRINGS = ("false", "0", "no", "n", "off")
+
+
+def _to_bool(value: Any) -> Optional[bool]:
+    """
+    Converts JSON booleans, 0/1 and their string forms ("false" is False, unlike bool("false"))
+    """
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in _TRUE_STRINGS:
+            return True
+        if value in _FALSE_STRINGS:
+            return False
+        return None
+    return bool(value)
+
+
+class Field:
+    """
+    Descriptor for a model field backed by a __slots__ entry named "_" + attribute name
+    """
+
+    def __init__(self, keys: Union[str, Tuple[str, ...]], type: Optional[type] = None, model: Optional[Type["SparkModel"]] = None, many: bool = False):
+        """
+        :param keys: JSON key (or alternative keys, first present wins)
+        :param type: Scalar type to convert to (None keeps the JSON value as-is)
+        :param model: Model class for nested objects, built around the decoded value when the fields are loaded
+        :param many: Whether the nested value is a list of model objects (returned as a tuple, items that aren't objects or
+                     lists are skipped)
+        """
+        self.keys = (keys,) if isinstance(keys, str) else keys
+        self.type = _to_bool if type is bool else type
+        self.model = model
+        self.many = many
+
+    def __set_name__(self, owner, name: str) -> None:
+        self.name = name
+        self.slot = f"_{name}"
+
+    def extract(self, data: Any) -> Any:
+        """
+        Pulls this field's value out of a decoded document
+        """
+        if not isinstance(data, dict):
+            return None
+        value = next((data[key] for key in self.keys if key in data), None)
+        if value is None:
+            return None
+        if self.model is not None:
+            if self.many:
+                # A single object where a list is expected is treated as a list of one
+                if isinstance(value, dict):
+                    return (self.model(value),)
+                if not isinstance(value, list):
+                    return None
+                return tuple(self.model(item) for item in value if isinstance(item, (dict, list)))
+            return self.model(value)
+        if self.type is not None:
+            try:
+                return self.type(value)
+            except (TypeError, ValueError):
+                return None
+        return tuple(value) if isinstance(value, list) else value
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = getattr(instance, self.slot, _MISSING)
+        if value is _MISSING:
+            instance._load_fields()
+            value = getattr(instance, self.slot)
+        return value
+
+
+class SparkModel:
+    """
+    Base class for the endpoint models
+    Subclasses declare Field attributes and a matching __slots__ tuple of "_" + field name
+    The body is kept as bytes until something needs it decoded, or as the decoded value when built from one (nested
+    models and list items), it is never re-encoded
+    """
+    __slots__ = ("_raw",)
+    _fields: Tuple[Field, ...] = ()
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        fields = []
+        for klass in reversed(cls.__mro__):
+            fields.extend(value for value in vars(klass).values() if isinstance(value, Field))
+        cls._fields = tuple(fields)
+
+    def __init__(self, raw: Union[bytes, str, dict, list]):
+        """
+        :param raw: Response body as bytes/str (decoded lazily) or an already decoded document (kept as-is)
+        """
+        if isinstance(raw, str):
+            raw = raw.encode()
+        self._raw = raw
+
+    def _document(self) -> Any:
+        """
+        The decoded document, decoding the body (without keeping the result) if it is still bytes
+        """
+        return codec.loads(self._raw) if isinstance(self._raw, bytes) else self._raw
+
+    @property
+    def raw(self) -> Any:
+        """
+        The full decoded response
+        A body still held as bytes is decoded once and kept decoded from then on, so repeated raw/get() calls don't
+        decode again (at the cost of holding the document). Treat the result as read-only
+        """
+        if isinstance(self._raw, bytes):
+            self._raw = codec.loads(self._raw)
+        return self._raw
+
+    @property
+    def raw_bytes(self) -> bytes:
+        """
+        The response as JSON bytes (encoded on demand if the model was built from, or has switched to, a decoded value)
+        """
+        return self._raw if isinstance(self._raw, bytes) else codec.dumps_bytes(self._raw)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Reads a top level key that isn't modelled as a field (see raw for the decoding cost)
+        """
+        data = self.raw
+        return data.get(key, default) if isinstance(data, dict) else default
+
+    def _load_fields(self) -> None:
+        """
+        Decodes the body once and caches every field in its slot, nested models wrap their part of the decoded document
+        """
+        data = self._document()
+        for field in self._fields:
+            setattr(self, field.slot, field.extract(data))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Modelled fields only, as a plain dict (nested models are converted too)
+        """
+        result = {}
+        for field in self._fields:
+            value = getattr(self, field.name)
+            if isinstance(value, SparkModel):
+                value = value.to_dict()
+            elif isinstance(value, tuple) and value and isinstance(value[0], SparkModel):
+                value = [item.to_dict() for item in value]
+            result[field.name] = value
+        return result
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class Coordinates(SparkModel):
+    """
+    A point given as a {"latitude": ..., "longitude": ...} style object or a [lat, lng] pair
+    """
+    __slots__ = ("_latitude", "_longitude")
+    latitude = Field(("latitude", "lat"), float)
+    longitude = Field(("longitude", "lng", "lon"), float)
+
+    def _load_fields(self) -> None:
+        data = self._document()
+        if isinstance(data, list):
+            data = {"latitude": data[0], "longitude": data[1]} if len(data) >= 2 else {}
+        for field in self._fields:
+            setattr(self, field.slot, field.extract(data))
+
+
+class VehicleAssociation(SparkModel):
+    __slots__ = ("_vehicle_id", "_association_status")
+    vehicle_id = Field("vehicleId", str)
+    association_status = Field("associationStatus", str)
+
+    @property
+    def is_associated(self) -> bool:
+        """
+        Whether the vehicle is currently (actively) associated with the account
+        """
+        return self.association_status == "ASSOCIATED"
+
+
+class VehicleSummary(SparkModel):
+    __slots__ = ("_odometer", "_fuel_level", "_battery_voltage", "_ignition", "_last_updated")
+    odometer = Field("odometer", float)
+    fuel_level = Field("fuelLevel", float)
+    battery_voltage = Field("batteryVoltage", float)
+    ignition = Field("ignition", str)
+    last_updated = Field("lastUpdated", str)
+
+
+class VehicleHealth(SparkModel):
+    __slots__ = ("_check_engine", "_dtc_codes", "_battery_health", "_last_updated")
+    check_engine = Field("checkEngine", bool)
+    dtc_codes = Field("dtcCodes")
+    battery_health = Field("batteryHealth", str)
+    last_updated = Field("lastUpdated", str)
+
+
+class VehicleLocation(SparkModel):
+    __slots__ = ("_latitude", "_longitude", "_speed", "_direction", "_timestamp")
+    latitude = Field(("latitude", "lat"), float)
+    longitude = Field(("longitude", "lng", "lon"), float)
+    speed = Field("speed", float)
+    direction = Field("direction", float)
+    timestamp = Field("timestamp", str)
+
+
+class VehicleDetails(SparkModel):
+    __slots__ = ("_client_id", "_make", "_model", "_year", "_vin")
+    client_id = Field("clientId", str)
+    make = Field("make", str)
+    model = Field("model", str)
+    year = Field("year", int)
+    vin = Field("vin", str)
+
+
+class Geofence(SparkModel):
+    __slots__ = ("_id", "_name", "_type", "_radius", "_center", "_points")
+    id = Field(("id", "geofenceId"), str)
+    name = Field("name", str)
+    type = Field("type", str)
+    radius = Field("radius", float)
+    center = Field("center", model=Coordinates)
+    points = Field(("points", "coordinates", "vertices"), model=Coordinates, many=True)
+
+
+class VehicleGeofences(SparkModel):
+    __slots__ = ("_geofences",)
+    geofences = Field(("geofences", "geofence", "data"), model=Geofence, many=True)
+
+
+def parse_associations(raw: Union[bytes, str, list]) -> List[VehicleAssociation]:
+    """
+    Splits the associations response (a list) into one model per vehicle
+    The body has to be decoded to split it, each model then keeps its decoded entry
+    :param raw: Response body or decoded list
+    :return: List of associations
+    """
+    data = codec.loads(raw) if isinstance(raw, (bytes, str)) else raw
+    return [VehicleAssociation(item) for item in data]
+
+
+def parse_vehicle_details(raw: Union[bytes, str, list, dict]) -> Optional[VehicleDetails]:
+    """
+    The details endpoint wraps the vehicle in a list, this returns the first (only) entry
+    The body has to be decoded to unwrap it, the model then keeps the decoded entry
+    :param raw: Response body or decoded document
+    :return: Vehicle details, or None if the response is empty
+    """
+    data = codec.loads(raw) if isinstance(raw, (bytes, str)) else raw
+    if isinstance(data, list):
+        return VehicleDetails(data[0]) if data else None
+    return VehicleDetails(data)
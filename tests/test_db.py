@@ -0,0 +1,55 @@
+import os
+import pytest
+
+pytest.importorskip("sqlalchemy")
+if not os.environ.get("SPARK_TEST_DB_URL"):
+    pytest.skip("SPARK_TEST_DB_URL is not set (a disposable database named spark)", allow_module_level=True)
+
+from POC.db import DB
+
+USER_HASH = -4242
+ENDPOINT = "test_out_of_order"
+
+
+@pytest.fixture
+def db():
+    DB.conn_string = os.environ["SPARK_TEST_DB_URL"]
+    DB.schema_ready = False
+    db = DB()
+    db.execute(r"""CREATE TABLE IF NOT EXISTS spark.public.response_data (
+        user_hash BIGINT, retrieve_dt_tm TIMESTAMPTZ, endpoint TEXT, response_data JSONB, vehicle_id TEXT)""", commit=True)
+    db.ensure_schema()
+    db.store_deltas, db.latest_cache = True, None
+    yield db
+    for table in ("response_data", "response_latest"):
+        db.execute(f"DELETE FROM spark.public.{table} WHERE user_hash = :user_hash", commit=True, parameters={"user_hash": USER_HASH})
+
+
+def _document(n: int) -> dict:
+    # Each document has a key of its own, so a delta applied to the wrong base leaves a stray key behind
+    return {"n": n, f"key_{n}": n, "fixed": "x" * 200}
+
+
+def _history(db: DB) -> list:
+    return [record["response_data"] for chunk in db.stream_response_records(USER_HASH, ENDPOINT) for record in chunk]
+
+
+def test_out_of_order_insert_keeps_history(db):
+    for n, minute in [(0, 0), (2, 2), (3, 3)]:
+        db.insert_response_record(USER_HASH, f"2024-01-01T00:0{minute}:00+00:00", ENDPOINT, _document(n))
+    # Lands between the first and second records, whose delta was taken against the first
+    db.insert_response_record(USER_HASH, "2024-01-01T00:01:00+00:00", ENDPOINT, _document(1))
+    assert _history(db) == [_document(n) for n in range(4)]
+    db.insert_response_record(USER_HASH, "2024-01-01T00:04:00+00:00", ENDPOINT, _document(4))
+    assert _history(db) == [_document(n) for n in range(5)]
+    result = db.get_endpoint_response(USER_HASH, ENDPOINT, 2)
+    assert result["n"].tolist() == [4, 3]
+    assert db.get_latest_response(USER_HASH, ENDPOINT)[0] == _document(4)
+
+
+def test_same_second_inserts_keep_insertion_order(db):
+    for n in range(3):
+        db.insert_response_record(USER_HASH, "2024-01-01T00:00:00+00:00", ENDPOINT, _document(n))
+    assert _history(db) == [_document(n) for n in range(3)]
+    assert db.get_endpoint_response(USER_HASH, ENDPOINT, 1, before_dt_tm="2024-01-01T00:00:01+00:00")["n"].tolist() == [2]
+    assert db.get_latest_response(USER_HASH, ENDPOINT)[0] == _document(2)
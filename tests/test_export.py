@@ -0,0 +1,97 @@
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+from POC import export
+from POC.export import UNMAPPED_COLUMN
+import json
+import numpy as np
+
+
+def _is_string(arrow_type) -> bool:
+    # Recent pandas versions back text columns with large_string
+    return pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type)
+
+
+def _records(responses: list) -> list:
+    return [{"retrieve_dt_tm": f"2024-01-01T00:0{i}:00Z", "last_seen_dt_tm": f"2024-01-01T00:0{i}:30Z", "response_data": response} for i, response in enumerate(responses)]
+
+
+def test_flatten_records():
+    flat = export.flatten_records(_records([
+        {"odometer": 100, "fuel": {"level": 0.5}, "dtcCodes": ["P0420"]},
+        {"odometer": 112, "fuel": {"level": 0.4, "unit": "pct"}, "dtcCodes": []},
+    ]))
+    assert list(flat.columns[:2]) == ["retrieve_dt_tm", "last_seen_dt_tm"]
+    assert str(flat["retrieve_dt_tm"].dt.tz) == "UTC"
+    assert flat["fuel.level"].tolist() == [0.5, 0.4]
+    assert flat["dtcCodes"].tolist() == ['["P0420"]', "[]"]
+    assert flat["fuel.unit"].isna().iloc[0] and flat["fuel.unit"].iloc[1] == "pct"
+
+
+def test_flatten_records_wraps_top_level_lists():
+    flat = export.flatten_records(_records([[{"vehicleId": "a"}], [{"vehicleId": "b"}]]))
+    assert flat["data"].map(json.loads).tolist() == [[{"vehicleId": "a"}], [{"vehicleId": "b"}]]
+
+
+def test_initial_schema():
+    flat = export.flatten_records(_records([
+        {"odometer": 100, "ignition": "OFF", "mixed": 1, "missing_none": None},
+        {"odometer": 112, "ignition": None, "mixed": "one", "missing_none": None, "missing_nan": 1},
+    ]))
+    # missing_nan is only set in the second row, so a first chunk of one row holds NaN for it
+    schema = export._initial_schema(flat.iloc[:1])
+    assert schema.field("odometer").type == pa.int64()
+    assert _is_string(schema.field("ignition").type)
+    assert schema.field("missing_none").type == pa.string()
+    assert _is_string(export._initial_schema(flat).field("mixed").type)
+    assert schema.field("missing_nan").type == pa.string()
+    assert schema.names[-1] == UNMAPPED_COLUMN
+
+
+def test_conform_moves_unknown_columns_and_bad_values_to_unmapped():
+    schema = export._initial_schema(export.flatten_records(_records([{"odometer": 100, "ignition": "OFF", "later": None}])))
+    flat = export.flatten_records(_records([
+        {"odometer": 101, "ignition": "ON", "later": 5},
+        {"odometer": "n/a", "later": 6, "speed": 30},
+    ]))
+    batch = export._conform(flat, schema)
+    assert batch.schema == schema
+    columns = batch.to_pydict()
+    # A bad value can't be cast, so the whole column's chunk goes to _unmapped
+    assert columns["odometer"] == [None, None]
+    assert columns["ignition"] == ["ON", None]
+    # Non-string values in a string column are serialized rather than dropped
+    assert columns["later"] == ["5", "6"]
+    assert [json.loads(extra) for extra in columns[UNMAPPED_COLUMN]] == [{"odometer": 101}, {"odometer": "n/a", "speed": 30}]
+
+
+def test_conform_large_string_column():
+    schema = pa.schema([pa.field("retrieve_dt_tm", pa.timestamp("ns", tz="UTC")), pa.field("last_seen_dt_tm", pa.timestamp("ns", tz="UTC")),
+                        pa.field("value", pa.large_string()), pa.field(UNMAPPED_COLUMN, pa.string())])
+    flat = export.flatten_records(_records([{"value": 1.5}, {"value": "text"}, {"value": np.nan}]))
+    columns = export._conform(flat, schema).to_pydict()
+    assert columns["value"] == ["1.5", "text", None]
+    assert columns[UNMAPPED_COLUMN] == [None, None, None]
+
+
+class _StubDB:
+    """
+    Yields fixed chunks in place of DB.stream_response_records
+    """
+    def __init__(self, chunks: list):
+        self.chunks = chunks
+
+    def stream_response_records(self, *args):
+        return iter(self.chunks)
+
+
+def test_export_responses_shares_first_schema(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    db = _StubDB([_records([{"odometer": 100}, {"odometer": 101}]), _records([{"odometer": 102, "speed": 5}])])
+    path = tmp_path / "out.parquet"
+    assert export.export_responses(str(path), 1, "vehicle_summary", db=db) == 3
+    table = pq.read_table(path)
+    assert table.column("odometer").to_pylist() == [100, 101, 102]
+    assert table.column(UNMAPPED_COLUMN).to_pylist() == [None, None, '{"speed": 5}']
+    assert export.export_responses(str(tmp_path / "empty.parquet"), 1, "vehicle_summary", db=_StubDB([])) == 0
+    assert not (tmp_path / "empty.parquet").exists()
@@ -0,0 +1,101 @@
+from POC import geofence
+from POC.geofence import Geofence, GeofenceEngine, GeofenceIndex
+from modules.hsparkapi import models
+import numpy as np
+import pytest
+
+SQUARE = Geofence("square", "Square", vertices=[(0, 0), (0, 1), (1, 1), (1, 0)])
+# Concave "U" (vertices are (lat, lng)): the notch between lng 0.4 and 0.6 above lat 0.5 is outside
+U_SHAPE = Geofence("u", "U", vertices=[(0, 0), (0, 1), (1, 1), (1, 0.6), (0.5, 0.6), (0.5, 0.4), (1, 0.4), (1, 0)])
+CIRCLE = Geofence("circle", "Circle", center=(38.9072, -77.0369), radius_m=250)
+# Spans 170E to 170W across the antimeridian
+PACIFIC = Geofence("pacific", "Pacific", vertices=[(-10, 170), (-10, -170), (10, -170), (10, 170)])
+
+
+def test_polygon_contains():
+    lat = np.array([0.5, 1.5, -0.1, 0.999])
+    lng = np.array([0.5, 0.5, 0.5, 0.001])
+    assert SQUARE.contains(lat, lng).tolist() == [True, False, False, True]
+    assert U_SHAPE.contains(np.array([0.8, 0.8, 0.2]), np.array([0.5, 0.8, 0.5])).tolist() == [False, True, True]
+
+
+def test_circle_contains():
+    # 0.001 degrees of latitude is about 111 m
+    lat = np.array([38.9072, 38.9072 + 0.002, 38.9072 + 0.003, 38.9072])
+    lng = np.array([-77.0369, -77.0369, -77.0369, -77.0369 + 0.004])
+    assert CIRCLE.contains(lat, lng).tolist() == [True, True, False, False]
+
+
+def test_antimeridian_polygon():
+    assert PACIFIC.crosses_antimeridian
+    lat = np.array([0, 0, 0, 0, 20])
+    lng = np.array([179.5, -179.5, 0, 160, 180])
+    assert PACIFIC.contains(lat, lng).tolist() == [True, True, False, False, False]
+
+
+@pytest.mark.parametrize("min_lng, max_lng, expected", [
+    (10, 20, [(10, 20)]),
+    (170, 190, [(170, 180), (-180, -170)]),
+    (-190, -170, [(170, 180), (-180, -170)]),
+    (-200, 200, [(-180, 180)]),
+])
+def test_lng_spans(min_lng, max_lng, expected):
+    assert geofence._lng_spans(min_lng, max_lng) == expected
+
+
+def test_index_matches_brute_force():
+    fences = [SQUARE, U_SHAPE, CIRCLE, PACIFIC, Geofence("dateline", "Dateline", center=(0, 179.99), radius_m=50000)]
+    rng = np.random.default_rng(7)
+    dateline_lng = (rng.uniform(179, 181, 500) + 180) % 360 - 180
+    lat = np.concatenate([rng.uniform(-1, 2, 2000), rng.normal(38.9072, 0.003, 500), rng.uniform(-15, 15, 2000), rng.uniform(-1, 1, 500), [np.nan, 0.5]])
+    lng = np.concatenate([rng.uniform(-1, 2, 2000), rng.normal(-77.0369, 0.003, 500), rng.uniform(-180, 180, 2000), dateline_lng, [0.5, np.nan]])
+    expected = np.column_stack([fence.contains(lat, lng) for fence in fences])
+    assert expected.any(axis=0).all()
+    for cell_size_deg in [0.01, 1, 90]:
+        np.testing.assert_array_equal(GeofenceIndex(fences, cell_size_deg).contains(lat, lng), expected)
+
+
+def test_engine_events_across_batches():
+    engine = GeofenceEngine([SQUARE, PACIFIC])
+    first = engine.evaluate("v1", ["2024-01-01T00:00:00Z", "2024-01-01T00:01:00Z"], [2, 0.5], [2, 0.5])
+    assert first[["geofence_id", "event"]].values.tolist() == [["square", "enter"]]
+    assert engine.currently_inside("v1") == ["square"]
+    # A missing coordinate is skipped rather than counted as an exit
+    second = engine.evaluate("v1", ["2024-01-01T00:05:00Z", "2024-01-01T00:06:00Z", "2024-01-01T00:07:00Z"], [np.nan, 0.6, 5], [np.nan, 0.6, 5])
+    assert second[["geofence_id", "event"]].values.tolist() == [["square", "exit"], ["square", "dwell"]]
+    assert second["dwell_seconds"].iloc[1] == 360
+    assert engine.currently_inside("v1") == []
+
+
+def test_engine_first_batch_inside_has_no_enter():
+    engine = GeofenceEngine([SQUARE])
+    assert engine.evaluate("v1", ["2024-01-01T00:00:00Z"], [0.5], [0.5]).empty
+    events = engine.evaluate("v1", ["2024-01-01T00:00:30Z"], [3], [3])
+    assert events["event"].tolist() == ["exit", "dwell"]
+    assert events["dwell_seconds"].iloc[1] == 30
+
+
+def test_parse_geofences_skips_incomplete_entries():
+    fences = geofence.parse_geofences({"geofences": [
+        {"id": "a", "center": {"latitude": 1}, "radius": 100},
+        {"id": "b", "center": [1, None], "radius": 100},
+        {"id": "c", "points": [{"lat": 0, "lng": 0}, {"lat": 0}, {"lat": 1, "lng": 1}]},
+        {"id": "d", "center": {"lat": 1, "lon": 2}, "radius": 100},
+        {"geofenceId": "e", "coordinates": [[0, 0], [0, 1], [1, 1]]},
+    ]})
+    assert [fence.id for fence in fences] == ["d", "e"]
+    assert fences[0].center == (1.0, 2.0)
+
+
+def test_from_response_accepts_model_and_raw_payloads():
+    fences = b'[{"geofenceId": "home", "center": [38.9072, -77.0369], "radius": 250}, "not a fence"]'
+    payloads = [
+        models.VehicleGeofences(b'{"geofences": ' + fences + b'}'),
+        fences,
+        fences.decode(),
+        {"id": "home", "center": {"lat": 38.9072, "lng": -77.0369}, "radius": 250},
+    ]
+    for payload in payloads:
+        engine = GeofenceEngine.from_response(payload)
+        assert [fence.id for fence in engine.index.geofences] == ["home"]
+        assert engine.index.geofences[0].center == (38.9072, -77.0369)
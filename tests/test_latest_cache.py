@@ -0,0 +1,48 @@
+from POC.latest_cache import LatestStateCache
+import time
+
+KEY = (1, "vehicle_summary", "v1")
+
+
+def test_put_get_invalidate():
+    cache = LatestStateCache(ttl=60)
+    assert cache.get(*KEY) is None
+    cache.put(*KEY, "value")
+    assert cache.get(*KEY) == "value"
+    cache.invalidate(*KEY)
+    assert cache.get(*KEY) is None
+
+
+def test_entries_expire_and_evict():
+    cache = LatestStateCache(ttl=0.01, max_entries=2)
+    cache.put(*KEY, "value")
+    time.sleep(0.02)
+    assert cache.get(*KEY) is None
+    cache = LatestStateCache(ttl=60, max_entries=2)
+    for vehicle_id in ["a", "b", "c"]:
+        cache.put(1, "vehicle_summary", vehicle_id, vehicle_id)
+    assert [cache.get(1, "vehicle_summary", vehicle_id) for vehicle_id in ["a", "b", "c"]] == [None, "b", "c"]
+
+
+def test_put_skipped_when_invalidated_during_read():
+    cache = LatestStateCache(ttl=60)
+    version = cache.version(*KEY)
+    # A writer commits and invalidates while the reader is still fetching the old row
+    cache.invalidate(*KEY)
+    cache.put(*KEY, "stale", version=version)
+    assert cache.get(*KEY) is None
+    # Other keys' invalidations don't affect the read
+    version = cache.version(*KEY)
+    cache.invalidate(1, "vehicle_summary", "other")
+    cache.put(*KEY, "fresh", version=version)
+    assert cache.get(*KEY) == "fresh"
+
+
+def test_forgotten_invalidations_still_skip_put():
+    cache = LatestStateCache(ttl=60, max_entries=2)
+    version = cache.version(*KEY)
+    cache.invalidate(*KEY)
+    for vehicle_id in ["a", "b"]:
+        cache.invalidate(1, "vehicle_summary", vehicle_id)
+    cache.put(*KEY, "stale", version=version)
+    assert cache.get(*KEY) is None
@@ -0,0 +1,83 @@
+from POC import snapshots
+import pytest
+
+OLD = {"odometer": 100, "fuel": {"level": 0.5, "unit": "pct"}, "dtcCodes": ["P0420"], "ignition": "OFF"}
+NEW = {"odometer": 112, "fuel": {"level": 0.4}, "dtcCodes": ["P0420", "P0171"], "speed": 30}
+
+
+def test_content_hash_ignores_key_order():
+    assert snapshots.content_hash({"a": 1, "b": {"c": 2, "d": 3}}) == snapshots.content_hash({"b": {"d": 3, "c": 2}, "a": 1})
+    assert snapshots.content_hash({"a": 1}) != snapshots.content_hash({"a": 2})
+
+
+def test_diff_paths():
+    delta = snapshots.diff(OLD, NEW)
+    assert sorted(delta["set"]) == sorted([[["odometer"], 112], [["fuel", "level"], 0.4], [["dtcCodes"], ["P0420", "P0171"]], [["speed"], 30]])
+    assert sorted(delta["unset"]) == sorted([["fuel", "unit"], ["ignition"]])
+
+
+@pytest.mark.parametrize("old, new", [
+    (OLD, NEW),
+    (NEW, OLD),
+    (OLD, OLD),
+    ({"a": {"b": {"c": 1}}}, {"a": {"b": 2}}),
+    ({"a": [1, 2]}, {"a": {"b": 1}}),
+    ({"a": 1}, [1, 2, 3]),
+    ([1, 2], {"a": 1}),
+    ({}, {"a": None}),
+])
+def test_apply_delta_round_trip(old, new):
+    assert snapshots.apply_delta(old, snapshots.diff(old, new)) == new
+
+
+def test_apply_delta_leaves_base_untouched():
+    base = {"fuel": {"level": 0.5, "unit": "pct"}}
+    snapshots.apply_delta(base, snapshots.diff(base, {"fuel": {"level": 0.1}}))
+    assert base == {"fuel": {"level": 0.5, "unit": "pct"}}
+
+
+def _store(documents: list) -> tuple:
+    """
+    Encodes documents (oldest first) the way insert_response_record does with deltas on and no snapshot limit
+    """
+    stored, is_delta = [documents[0]], [False]
+    for previous, document in zip(documents, documents[1:]):
+        stored.append(snapshots.diff(previous, document))
+        is_delta.append(True)
+    return stored, is_delta
+
+
+def test_rebuild_chain():
+    documents = [{"n": i, "fixed": "x", "even": i % 2 == 0} for i in range(5)]
+    stored, is_delta = _store(documents)
+    assert snapshots.rebuild(stored, is_delta) == documents
+
+
+def test_rebuild_restarts_at_full_snapshot_and_skips_missing_base():
+    assert snapshots.rebuild([{"a": 1}, {"set": [[["a"], 2]], "unset": []}, {"a": 5}], [False, True, False]) == [{"a": 1}, {"a": 2}, {"a": 5}]
+    assert snapshots.rebuild([{"set": [[["a"], 2]], "unset": []}, {"a": 5}], [True, False]) == [None, {"a": 5}]
+
+
+@pytest.mark.parametrize("window", [1, 2, 4])
+def test_rebuild_window_uses_older_rows_as_base(window):
+    documents = [{"n": i, "nested": {"i": i}} for i in range(8)]
+    stored, is_delta = _store(documents[:3])
+    more, more_is_delta = _store(documents[3:])
+    stored, is_delta = stored + more, is_delta + more_is_delta
+    # Newest first, as the history query returns them
+    stored, is_delta = stored[::-1], is_delta[::-1]
+    rebuilt = snapshots.rebuild_window(stored[:window], is_delta[:window], stored[window:], is_delta[window:])
+    assert rebuilt == documents[::-1][:window]
+
+
+def test_rebuild_window_stops_at_newest_base_snapshot():
+    # Rows older than the newest full base snapshot must not affect the result
+    window = [{"set": [[["a"], 3]], "unset": []}]
+    base = [{"a": 2, "b": 1}, {"set": [[["b"], 9]], "unset": []}, {"a": 0}]
+    assert snapshots.rebuild_window(window, [True], base, [False, True, False]) == [{"a": 3, "b": 1}]
+
+
+def test_rebuild_window_without_base_snapshot():
+    window = [{"set": [[["a"], 3]], "unset": []}, {"a": 1}]
+    assert snapshots.rebuild_window(window, [True, False], [], []) == [{"a": 3}, {"a": 1}]
+    assert snapshots.rebuild_window(window[:1], [True], [{"set": [], "unset": []}], [True]) == [None]